@@ -1,7 +1,17 @@
+import argparse
+import heapq
+import time
+import zipfile
+
+import numpy as np
 import pyxel
 
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:  # No process support (e.g. in the browser): solve levels one by one
+    ProcessPoolExecutor = None
+
 ### utils.py
-from collections import deque
 from itertools import chain, repeat
 
 
@@ -40,124 +50,92 @@ istext = lambda symbol: symbol in TEXT
 isempty = lambda cell: cell == "."
 
 
-def windowed(seq, n, fillvalue=None, step=1):
-    if n < 0:
-        raise ValueError('n must be >= 0')
-    if n == 0:
-        yield tuple()
-        return
-
-    window = deque(maxlen=n)
-    i = n
-    for _ in map(window.append, seq):
-        i -= 1
-        if not i:
-            i = step
-            yield tuple(window)
-
-    size = len(window)
-    if size == 0:
-        return
-    elif size < n:
-        yield tuple(chain(window, repeat(fillvalue, n - size)))
-    elif 0 < i < min(step, n):
-        window += (fillvalue,) * i
-        yield tuple(window)
-
-
-def flatten(listOfLists):
-    return chain.from_iterable(listOfLists)
-
-
-def grid_to_string(grid, row_delimiter="\n", col_delimiter=""):
-    """Convert grid to multiline string"""
-    return row_delimiter.join(col_delimiter.join(row) for row in grid)
-
-
-def string_to_grid(string, row_delimiter="\n", col_delimiter=""):
-    """Convert multiline string to grid"""
-    return [
-        [cell for cell in row.replace(col_delimiter, "")]
-        for row in string.split(row_delimiter)
-    ]
+# Cell encoding
+# Each cell of a Board is a small int: the low bits are a code for its symbol
+# ("." is 0) and the high bits the direction an entity faces, an index into STEPS
+CELLS = (".", *TEXT, *ENTITIES)
+CODES = {symbol: code for code, symbol in enumerate(CELLS)}
+CODE_MASK = 0b111111
+DIR_SHIFT = 6
+EMPTY = 0
 
+# Behaviours are a bitmask per kind of cell: one kind per noun, and one for all text
+KINDS = (*NOUNS, "text")
+PROPERTY_BITS = {prop: 1 << i for i, prop in enumerate(PROPERTIES)}
+YOU, PUSH, WIN, HOT, MELT, SINK = (PROPERTY_BITS[prop] for prop in PROPERTIES)
 
-def transpose(grid):
-    return [list(col) for col in zip(*grid)]
 
+def cell_table(lookup):
+    """Per-cell lookup table of all 256 cells, whatever way they face"""
+    by_code = [lookup(symbol) for symbol in CELLS]
+    by_code += [by_code[EMPTY]] * (CODE_MASK + 1 - len(CELLS))
+    return np.array(by_code * (256 // (CODE_MASK + 1)))
 
-def fliplr(grid):
-    return [list(reversed(row)) for row in grid]
 
+IS_TEXT = cell_table(istext)
+IS_NOUN = cell_table(isnoun)
+IS_PROPERTY = cell_table(isproperty)
+IS_IS = cell_table(isis)
+IS_ENTITY = cell_table(isentity)
+TEXT_OF = cell_table(lambda symbol: CODES[symbol] if istext(symbol) else EMPTY).astype(np.uint8)
+KIND = cell_table(lambda symbol: (
+    KINDS.index("text") if istext(symbol)
+    else KINDS.index("empty") if isempty(symbol)
+    else KINDS.index(symbol.lower())
+))
 
-def rotate_p90(grid):
-    """Rotate grid 90 deg clockwise"""
-    return fliplr(transpose(grid))
 
-
-def rotate_m90(grid):
-    """Rotate grid 90 deg counterclockwise"""
-    return transpose(fliplr(grid))
-
-
-def rotate_180(grid):
-    """Rotate grid 180 deg"""
-    return rotate_p90(rotate_p90(grid))
-
-
-def empty_NM(N, M, element="."):
-    """Make an empty NxM grid"""
-    return [[element for _ in range(M)] for _ in range(N)]
+def flatten(listOfLists):
+    return chain.from_iterable(listOfLists)
 
 
-def make_behaviour(you=False, push=False, win=False, hot=False, melt=False, sink=False):
+def make_behaviour(*properties):
     """Helper to make a behaviour"""
-    return dict(zip(PROPERTIES, (you, push, win, hot, melt, sink)))
+    return sum(PROPERTY_BITS[prop] for prop in properties)
 
 
-def isvalidgrid(grid):
-    """A pile of assertions to check that the grid is valid"""
+def encode(symbol, dir='>'):
+    """Cell of a symbol, facing dir if it's an entity"""
+    if isentity(symbol):
+        return CODES[symbol] | STEPS.index(dir) << DIR_SHIFT
+    return CODES[symbol]
 
-    # Make sure grid is a list of lists
-    assert isinstance(grid, list), "Grid is not a list"
-    assert len(grid) > 0, "Grid is an empty list"
-    assert isinstance(grid[0], list), "Grid must be a list of lists"
 
-    N, M = len(grid), len(grid[0])
+def decode(cell):
+    """Symbol of a cell, as an Entity facing the right way if it is one"""
+    symbol = CELLS[cell & CODE_MASK]
+    if isentity(symbol):
+        symbol = Entity(symbol)
+        symbol.dir = STEPS[cell >> DIR_SHIFT]
+    return symbol
 
-    assert M > 0, "Grid has zero width"
 
-    for row in grid:
-        assert len(row) == M, "Grid must be rectangular"
-        for cell in row:
-            assert cell in (*SYMBOLS, "."), f"'{cell}' is not a valid symbol"
+### rules.py
+def linerules(lines):
+    """Find the rules along each row of a 2D array of cells, as a list per row"""
+    rules = [[] for _ in lines]
+
+    # Check every candidate against the grammar
+    # Noun is (Noun OR Property)
+    first, second, third = lines[:, :-2], lines[:, 1:-1], lines[:, 2:]
+    isrule = IS_NOUN[first] & IS_IS[second] & (IS_NOUN[third] | IS_PROPERTY[third])
+    for line, subject, action in zip(np.nonzero(isrule)[0].tolist(), first[isrule].tolist(), third[isrule].tolist()):
+        rules[line].append((CELLS[subject], CELLS[action]))
+    return rules
 
 
-### rules.py
 def rulefinder(grid):
     """Find all the rules in the grid"""
-    N, M = len(grid), len(grid[0])
+    N, M = grid.shape
     rules = []
 
-    # Check every candidate against the grammar
-    # Noun is (Noun OR Property)
-    isrule = lambda t: (
-        isnoun(t[0]) and isis(t[1]) and (isnoun(t[2]) or isproperty(t[2]))
-    )
-
     # Horizontal rules
     if M >= 3:
-        for row in grid:
-            for t in windowed(row, 3):
-                if isrule(t):
-                    rules.append((t[0], t[2]))
+        rules += flatten(linerules(grid))
 
     # Vertical rules
     if N >= 3:
-        for col in zip(*grid):
-            for t in windowed(col, 3):
-                if isrule(t):
-                    rules.append((t[0], t[2]))
+        rules += flatten(linerules(grid.T))
 
     # Sort according to the first letter
     # rules = sorted(rules,key=lambda x:x[0])
@@ -168,31 +146,34 @@ def rulefinder(grid):
 def ruleparser(rules):
     """Parse valid rules into behaviours and swaps"""
 
-    behaviours = {noun: (make_behaviour()) for noun in NOUNS}
+    behaviours = np.zeros(len(KINDS), dtype=np.uint8)
     swaps = []
 
     # Parse the rules
     for subject, action in rules:
         # Noun is (Noun OR Property)
         if isproperty(action):  # Noun is a Property
-            behaviours[subject][action] = True
+            behaviours[KINDS.index(subject)] |= PROPERTY_BITS[action]
         else:  # (Noun is Noun)
             swaps.append((subject, action))
 
     swaps = sorted(swaps)
 
     # Add entry for text behaviour
-    behaviours["text"] = make_behaviour(push=True)
+    behaviours[KINDS.index("text")] = make_behaviour("push")
 
     return behaviours, swaps
 
 
 ### main.py
 from collections import defaultdict
-from copy import deepcopy
 
 
 BOARD_SIZE = 16
+LEVELS = 3
+RESOURCE_FILE = "game.pyxres"
+SOLVER_MAX_STATES = 100000  # States each search looks at before giving up on a level (too few for level 2)
+SOLVER_WEIGHTS = (0, 2)  # Searches tried in turn: breadth first for the shortest solution, then best first
 SPRITE_NAMES = {
     (16, 0): 'baba',
     (17, 0): 'flag',
@@ -228,13 +209,8 @@ SPRITE_POS = {v: k for k, v in SPRITE_NAMES.items()}
 
 STEPS = ("^", "V", "<", ">")
 
-# Rotations and counter rotations which need to be applied to the grid such that the move direction is up
-rotate_0 = lambda x: x
-# Null rotation
-rots = (rotate_0, rotate_180, rotate_p90, rotate_m90)
-rots = dict(zip(STEPS, rots))
-crots = (rotate_0, rotate_180, rotate_m90, rotate_p90)
-crots = dict(zip(STEPS, crots))
+# Rows and columns to the next cell in the direction of each step
+STEP_OFFSETS = {"^": (-1, 0), "V": (1, 0), "<": (0, -1), ">": (0, 1)}
 
 
 class GameEnd(Exception):
@@ -253,161 +229,225 @@ class YouLose(GameEnd):
     pass
 
 
+class ResourceTilemap:
+    """Tilemap 0 read straight from a resource file, for loading levels without a window"""
+
+    def __init__(self, path=RESOURCE_FILE):
+        with zipfile.ZipFile(path) as resource:
+            self.rows = resource.read("pyxel_resource/tilemap0").decode().splitlines()
+
+    def pget(self, x, y):
+        tile = self.rows[y][x * 4:x * 4 + 4]
+        return int(tile[:2], 16), int(tile[2:], 16)
+
+
 class Board:
-    def __init__(self, level):
-        tilemap = pyxel.tilemap(0)
-        self.grid = []
+    def __init__(self, level, tilemap=None):
+        tilemap = tilemap or pyxel.tilemap(0)
         map_start = level * BOARD_SIZE
-        for y in range(BOARD_SIZE):
-            self.grid.append([])
-            for x in range(map_start, map_start + BOARD_SIZE):
-                sprite_index = tilemap.pget(x, y)
-                self.grid[-1].append(SPRITE_NAMES[sprite_index])
+        self.grid = np.array([
+            [encode(SPRITE_NAMES[tilemap.pget(x, y)]) for x in range(map_start, map_start + BOARD_SIZE)]
+            for y in range(BOARD_SIZE)
+        ], dtype=np.uint8)
+        self.buffer = np.empty_like(self.grid)
+        self.ruletext = None
+
+    @classmethod
+    def from_symbols(cls, grid):
+        """Make a board from a list of lists of symbols, for custom levels of any size"""
+        board = cls.__new__(cls)
+        board.grid = np.array([[encode(cell, getattr(cell, 'dir', '>')) for cell in row] for row in grid],
+                              dtype=np.uint8)
+        board.buffer = np.empty_like(board.grid)
+        board.ruletext = None
+        return board
+
+    def symbols(self):
+        """The grid as a list of lists of symbols"""
+        return [[decode(cell) for cell in row] for row in self.grid.tolist()]
+
+    def snapshot(self):
+        """Immutable copy of the grid"""
+        return self.grid.tobytes()
+
+    def restore(self, snapshot):
+        """Put the grid back the way it was when the snapshot was taken"""
+        self.grid = np.frombuffer(snapshot, dtype=np.uint8).reshape(self.grid.shape).copy()
 
     @staticmethod
-    def swap(grid, swaps):
-        """Apply all the swaps to the grid"""
-
-        stationary = (a for a, b in swaps if a == b)
-        swaps = ((a, b) for a, b in swaps if a != b and a not in stationary)
-
-        new_grid = deepcopy(grid)
+    def swaptable(swaps):
+        """Table of what every cell becomes after the swaps, None if nothing swaps
+
+        A noun swaps by the first of its rules, unless a rule says it is itself
+        ("X is X"). The grid is swapped in a single pass by looking every cell up.
+        """
+        stationary = {a for a, b in swaps if a == b}
+        table = np.arange(256, dtype=np.uint8)
+        swapped = set(stationary)
         for a, b in swaps:
-            for j, row in enumerate(grid):
-                for k, cell in enumerate(row):
-                    if isentity(cell):
-                        # If the rule applies to the cell, and no other rule has been applied yet
-                        if cell.lower() == a and new_grid[j][k] == cell:
-                            if b == 'empty':
-                                new_grid[j][k] = '.'
-                            else:
-                                new_grid[j][k] = Entity(b.capitalize())
+            if a in swapped or not isnoun(a):
+                continue
+            swapped.add(a)
+            # The entity turns into the new one, whichever way it faced
+            table[CODES[a.capitalize()]::CODE_MASK + 1] = EMPTY if b == 'empty' else encode(Entity(b.capitalize()))
 
-        return new_grid
+        return table if len(swapped) > len(stationary) else None
 
-    def attempt_to_move(self, pile, behaviours):
+    def attempt_to_move(self, pile, properties):
         """Attempt to move a pile of cells in accordance with their behaviour"""
 
         if len(pile) == 0:  # Empty pile
             raise UnableToMove
 
-        if isempty(pile[0]):  # Trivial pile
+        if pile[0] == EMPTY:  # Trivial pile
             return pile
         elif len(pile) == 1:  # One-element pile
             raise UnableToMove
 
-        def _is(cell, property):
-            if istext(cell):
-                cell = "text"
-            elif cell == '.':
-                cell = 'empty'
-            return behaviours[cell.lower()][property]
-        ispush = lambda cell: _is(cell, "push")
-        issink = lambda cell: _is(cell, "sink")
-        ishot = lambda cell: _is(cell, "hot")
-        ismelt = lambda cell: _is(cell, "melt")
+        first, second = properties[pile[0]], properties[pile[1]]
 
         # Larger pile
-        def could_move():
-            return (
-                isempty(pile[1])
-            ) or (
-                ispush(pile[1])
-            ) or (
-                issink(pile[0])
-            ) or (
-                issink(pile[1])
-            ) or (
-                ishot(pile[0]) and ismelt(pile[1])
-            ) or (
-                ismelt(pile[0]) and ishot(pile[1])
-            )
-
-        if not could_move():
+        could_move = (
+            pile[1] == EMPTY
+        ) or (
+            second & PUSH
+        ) or (
+            first & SINK
+        ) or (
+            second & SINK
+        ) or (
+            first & HOT and second & MELT
+        ) or (
+            first & MELT and second & HOT
+        )
+
+        if not could_move:
             raise UnableToMove
 
-        if issink(pile[0]) or issink(pile[1]):
-            return ('.', '.', *pile[2:])
+        if first & SINK or second & SINK:
+            return (EMPTY, EMPTY, *pile[2:])
 
-        if ishot(pile[1]) and ismelt(pile[0]):
-            return ('.', pile[1], *pile[2:])
-        if ismelt(pile[1]) and ishot(pile[0]):
-            return ('.', pile[0], *pile[2:])
+        if second & HOT and first & MELT:
+            return (EMPTY, pile[1], *pile[2:])
+        if second & MELT and first & HOT:
+            return (EMPTY, pile[0], *pile[2:])
 
-        if isempty(pile[1]):
-            return ('.', pile[0], *pile[2:])
+        if pile[1] == EMPTY:
+            return (EMPTY, pile[0], *pile[2:])
 
-        budged = self.attempt_to_move(pile[1:], behaviours)
+        budged = self.attempt_to_move(pile[1:], properties)
         return (budged[0], pile[0], *budged[1:])
 
-    def runstep(self, step, behaviours):
-        """Advance grid a single step, given the step and the current behaviours"""
-        grid = rots[step](self.grid)
-        N, M = len(grid), len(grid[0])
-        new_grid = empty_NM(N, M)
+    def runstep(self, step, you):
+        """Advance grid a single step, given the step and the cells that are you"""
+        N, M = self.grid.shape
+        rows, cols = STEP_OFFSETS[step]
+        stride = rows * M + cols
+        flat = self.buffer.reshape(-1)
+        np.copyto(self.buffer, self.grid)
+
+        properties = self.properties
+        facing = STEPS.index(step) << DIR_SHIFT
+
+        # How many cells are ahead of each, and how far across it is
+        r, c = np.divmod(you, M)
+        if step == "^":
+            ahead, across = r, c
+        elif step == "V":
+            ahead, across = N - 1 - r, M - 1 - c
+        elif step == "<":
+            ahead, across = c, N - 1 - r
+        else:
+            ahead, across = M - 1 - c, r
+        order = np.lexsort((across, ahead))
+
+        # Cells that aren't you stay put unless they're pushed, so only the you cells are visited
+        for i, j in zip(you[order].tolist(), ahead[order].tolist()):
+            cell = int(flat[i]) & CODE_MASK | facing
+            end = i + stride * (j + 1)
+            pile = flat[i:end if end >= 0 else None:stride]
+
+            # Attempt to move
+            try:
+                pile[:] = self.attempt_to_move([cell] + pile[1:].tolist(), properties)
+
+            except UnableToMove:
+                if len(pile) > 1 and IS_ENTITY[pile[1]] and properties[pile[1]] & WIN:
+                    raise YouWin(
+                        f"You are '{decode(cell)}' and you've walked onto a '{decode(cell)}'"
+                        " which is 'win'. Hooray! :D "
+                    )
+                pile[0] = cell
+
+        new_grid, self.buffer = self.buffer, self.grid
+        return new_grid
 
-        isyou = lambda cell: isentity(cell) and behaviours[cell.lower()]["you"]
-        iswin = lambda cell: isentity(cell) and behaviours[cell.lower()]["win"]
+    def rules(self):
+        """Behaviours and swaps of the rules on the board
+
+        Only text can form rules, so the text the rules were last found from is
+        kept along with the rules in each row and column. Rules are found again
+        only along the rows and columns where the text has changed since, and the
+        parsed behaviours and swaps are reused if it hasn't changed at all, along
+        with what update works out from them.
+        """
+        text = TEXT_OF[self.grid]
+        if self.ruletext is None or self.ruletext.shape != text.shape:
+            rows, cols = np.arange(text.shape[0]), np.arange(text.shape[1])
+            self.rowrules, self.colrules = [[]] * text.shape[0], [[]] * text.shape[1]
+        elif text.tobytes() == self.ruletext.tobytes():
+            return self.parsed
+        else:
+            moved = text != self.ruletext
+            rows, cols = np.flatnonzero(moved.any(axis=1)), np.flatnonzero(moved.any(axis=0))
 
-        for j, row in enumerate(grid):
-            for k, cell in enumerate(row):
-                if isempty(cell):
-                    continue  # Already empty
+        for j, rules in zip(rows.tolist(), linerules(text[rows])):
+            self.rowrules[j] = rules
+        for k, rules in zip(cols.tolist(), linerules(text[:, cols].T)):
+            self.colrules[k] = rules
 
-                if not isyou(cell):
-                    new_grid[j][k] = cell
-                    continue
+        self.ruletext = text
+        self.parsed = behaviours, swaps = ruleparser(sorted(chain(flatten(self.rowrules), flatten(self.colrules))))
 
-                cell.dir = step
+        # The noun that is both you and win, and nouns that are hot and melt melt away
+        kinds = list(zip(KINDS, behaviours.tolist()))
+        self.winner = next((noun for noun, behaviour in kinds if behaviour & YOU and behaviour & WIN), None)
+        self.becomes = self.swaptable(swaps + [(noun, 'empty') for noun, behaviour in kinds if behaviour & HOT and behaviour & MELT])
 
-                # Attempt to move
-                pile = [cell] + [new_grid[l][k] for l in reversed(range(j))]
-                try:
-                    shifted_pile = self.attempt_to_move(pile, behaviours)
-                    for l, elem in enumerate(reversed(shifted_pile)):
-                        new_grid[l][k] = elem
-
-                except UnableToMove:
-                    if len(pile) > 1 and iswin(pile[1]):
-                        raise YouWin(
-                            f"You are '{cell}' and you've walked onto a '{pile[0]}'"
-                            " which is 'win'. Hooray! :D "
-                        )
-                    new_grid[j][k] = cell
-
-        new_grid = crots[step](new_grid)
-        return new_grid
+        # Behaviour of each cell, and whether it's an entity that is you
+        properties = behaviours[KIND]
+        self.properties = properties.tolist()
+        self.isyou = IS_ENTITY & (properties & YOU > 0)
+        self.iswin = IS_ENTITY & (properties & WIN > 0)
+        return self.parsed
 
     def update(self, step=None):
-        rules = rulefinder(self.grid)
-        behaviours, swaps = ruleparser(rules)
+        self.rules()
 
         # Check for you is win condition
-        for noun in behaviours:
-            if behaviours[noun]["you"] and behaviours[noun]["win"]:
-                raise YouWin(f"You are '{noun}' and you are 'win'. Hooray! :D")
-
-            if behaviours[noun]["hot"] and behaviours[noun]["melt"]:
-                swaps.append((noun, 'empty'))
+        if self.winner is not None:
+            raise YouWin(f"You are '{self.winner}' and you are 'win'. Hooray! :D")
 
         # Do the swap
-        self.grid = self.swap(self.grid, swaps)
+        if self.becomes is not None:
+            np.take(self.becomes, self.grid, out=self.grid)
 
-        entities_present = {j.lower() for j in flatten(self.grid) if isentity(j)}
-        if not any(behaviours[e]["you"] for e in entities_present):
+        you = np.flatnonzero(self.isyou[self.grid])
+        if not len(you):
             raise YouLose("Nothing is 'you'. Game over.")
 
         # Timestep the grid
         if step:
-            self.grid = self.runstep(step, behaviours)
+            self.grid = self.runstep(step, you)
 
     def draw(self):
-        for _y, row in enumerate(self.grid):
-            for _x, tilename in enumerate(row):
+        for _y, row in enumerate(self.grid.tolist()):
+            for _x, cell in enumerate(row):
                 x, y = _x*9, _y*9
 
-                if tilename == '.':
+                if cell == EMPTY:
                     continue
+                tilename = CELLS[cell & CODE_MASK]
                 u, v = SPRITE_POS[tilename]
 
                 if tilename in PROPERTIES:
@@ -416,7 +456,7 @@ class Board:
                     pyxel.rect(x+8, y, 1, 9, corner)
 
                 if tilename == 'Baba':
-                    v += '>V^<'.index(tilename.dir)
+                    v += '>V^<'.index(STEPS[cell >> DIR_SHIFT])
 
                 pyxel.blt(x, y, 0, u*8, v*8, 8, 8)
 
@@ -424,7 +464,7 @@ class Board:
 class App:
     def __init__(self):
         pyxel.init(BOARD_SIZE*9, BOARD_SIZE*9, display_scale=5, title="BABA IS YOU")
-        pyxel.load("game.pyxres")
+        pyxel.load(RESOURCE_FILE)
         self.level = -1
         self.stop_banner = None
         self.next_level()
@@ -433,22 +473,28 @@ class App:
     def next_level(self):
         self.level += 1
         self.stop_banner = None
-        if self.level > 2:
+        if self.level >= LEVELS:
             self.stop_banner = self.show_end
 
         self.board = Board(self.level)
         if self.stop_banner is None:
             self.board.update()
         self.last_input = None
-        self.all_steps = ''
+        # Snapshots of the board after each move, and of the moves undone since
+        self.history = [self.board.snapshot()]
+        self.future = []
 
     def undo(self):
+        # A move that won or lost stops part way, so undoing it goes back to the last snapshot
+        if self.stop_banner is None and len(self.history) > 1:
+            self.future.append(self.history.pop())
         self.stop_banner = None
-        self.board = Board(self.level)
-        self.all_steps = self.all_steps[:-1]
-        for step in self.all_steps:
-            self.board.update(step)
-            self.board.update()
+        self.board.restore(self.history[-1])
+
+    def redo(self):
+        if self.future:
+            self.history.append(self.future.pop())
+            self.board.restore(self.history[-1])
 
     @staticmethod
     def show_win():
@@ -477,6 +523,8 @@ class App:
             inp = 'V'
         elif pyxel.btn(pyxel.KEY_SPACE) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_A):
             inp = 'X'
+        elif pyxel.btn(pyxel.KEY_R) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_B):
+            inp = 'R'
         else:
             self.last_input = None
 
@@ -487,17 +535,20 @@ class App:
             if (self.stop_banner is None or self.stop_banner in [self.show_lose, self.show_win]) and inp == 'X':
                 self.undo()
 
+            elif self.stop_banner is None and inp == 'R':
+                self.redo()
+
             elif self.stop_banner is None and inp in '<>^V':
+                self.future = []
                 try:
                     self.board.update(inp)
                     self.board.update()
+                    self.history.append(self.board.snapshot())
                 except YouWin:
                     self.stop_banner = self.show_win
                 except YouLose:
                     self.stop_banner = self.show_lose
 
-                self.all_steps += inp
-
             elif self.stop_banner == self.show_win:
                 self.next_level()
 
@@ -510,4 +561,107 @@ class App:
             self.stop_banner()
 
 
-App()
+### solver.py
+def distance_to_win(board):
+    """Fewest steps from a cell that is you to one that is win, if nothing were in the way"""
+    N, M = board.grid.shape
+    you = np.flatnonzero(board.isyou[board.grid])
+    win = np.flatnonzero(board.iswin[board.grid])
+    if not len(you) or not len(win):
+        return N + M
+    (you_rows, you_cols), (win_rows, win_cols) = np.divmod(you, M), np.divmod(win, M)
+    return int((np.abs(you_rows[:, None] - win_rows) + np.abs(you_cols[:, None] - win_cols)).min())
+
+
+def solve(board, max_states=SOLVER_MAX_STATES, weight=0):
+    """Steps that win (None if none were found), the states seen, and whether they were all it can reach"""
+    try:
+        board.update()
+    except YouWin:
+        return "", 1, True
+    except YouLose:
+        return None, 1, True
+
+    # States are the grid without the way entities face, which never changes how it plays
+    start = (board.grid & CODE_MASK).tobytes()
+    parents = {start: None}
+    frontier = [(0, 0, 0, start)]  # (priority, order seen, steps taken, state)
+    while frontier and len(parents) < max_states:
+        _, _, taken, state = heapq.heappop(frontier)
+        for step in STEPS:
+            board.restore(state)
+            try:
+                board.update(step)
+                board.update()
+            except YouWin:
+                steps = [step]
+                while parents[state] is not None:
+                    state, previous = parents[state]
+                    steps.append(previous)
+                return "".join(reversed(steps)), len(parents), False
+            except YouLose:
+                continue
+
+            child = (board.grid & CODE_MASK).tobytes()
+            if child not in parents:
+                parents[child] = (state, step)
+                priority = taken + 1 + (weight * distance_to_win(board) if weight else 0)
+                heapq.heappush(frontier, (priority, len(parents), taken + 1, child))
+
+    return None, len(parents), not frontier
+
+
+def solve_level(level, path=RESOURCE_FILE, max_states=SOLVER_MAX_STATES, weights=SOLVER_WEIGHTS):
+    """Solve a level of a resource file with each search in turn, until one settles it"""
+    start = time.perf_counter()
+    states = 0
+    for weight in weights:
+        solution, seen, exhausted = solve(Board(level, ResourceTilemap(path)), max_states, weight)
+        states += seen
+        if solution is not None or exhausted:
+            break
+    return {
+        "level": level,
+        "solution": solution,
+        "shortest": solution is not None and weight == 0,
+        "states": states,
+        "exhausted": exhausted,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def solve_levels(levels=range(LEVELS), path=RESOURCE_FILE, max_states=SOLVER_MAX_STATES,
+                 weights=SOLVER_WEIGHTS, workers=None):
+    """Solve levels side by side in worker processes (or one by one where there are none)"""
+    if ProcessPoolExecutor is None or workers == 1:
+        return [solve_level(level, path, max_states, weights) for level in levels]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(solve_level, levels, repeat(path), repeat(max_states), repeat(weights)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="game.py", description="BABA IS YOU",
+        epilog="The default budget solves levels 0 and 1 in about 30 s but leaves level 2 unknown. "
+               "--levels 2 --weights 3 --max-states 1500000 solves it in 47 steps after about 1.3 million "
+               "states (a few minutes). Only breadth-first solutions are known to be shortest.")
+    parser.add_argument("--solve", action="store_true", help="find a solution to each level without a window")
+    parser.add_argument("--levels", type=int, nargs="+", default=list(range(LEVELS)), help="levels to solve")
+    parser.add_argument("--max-states", type=int, default=SOLVER_MAX_STATES, help="states each search looks at before giving up (default %(default)s)")
+    parser.add_argument("--weights", type=float, nargs="+", default=list(SOLVER_WEIGHTS),
+                        help="searches to try in turn (0 is breadth first, more favours states nearer the win)")
+    parser.add_argument("--workers", type=int, default=None, help="processes to solve levels in")
+    args, _ = parser.parse_known_args()  # Leave pyxel's own arguments (pyxel run game.py)
+    if args.solve:
+        for result in solve_levels(args.levels, RESOURCE_FILE, args.max_states, args.weights, args.workers):
+            if result["solution"] is not None:
+                shortest = "shortest" if result["shortest"] else "not known to be shortest"
+                outcome = f"solved in {len(result['solution'])} steps ({shortest}): {result['solution']}"
+            elif result["exhausted"]:
+                outcome = "can't be won, every state it can reach was searched"
+            else:
+                outcome = (f"unknown, no solution in the first {args.max_states} states of each search "
+                           "(see --help for a budget that settles it)")
+            print(f"level {result['level']}: {outcome} ({result['states']} states, {result['seconds']:.2f}s)")
+    else:
+        App()
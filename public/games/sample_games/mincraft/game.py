@@ -1,6 +1,25 @@
 import pyxel
 import numpy as np
 import random
+import json
+import os
+import struct
+import time
+import zlib
+import argparse
+import heapq
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:  # Not available on Windows or the web
+    resource = None
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+except ImportError:  # No process support (e.g. in the browser): generate in this process
+    ProcessPoolExecutor = None
 
 # Game constants
 WIDTH = 160
@@ -9,7 +28,70 @@ DISPLAY_WIDTH = 15  # Zoomed display is 15x15 pixels
 DISPLAY_HEIGHT = 15
 INVENTORY_HEIGHT = 3  # Height of the inventory bar
 TOTAL_DISPLAY_HEIGHT = DISPLAY_HEIGHT + INVENTORY_HEIGHT
+VIEWPORT_IMAGE = 0  # Image bank the visible blocks are copied into each frame
 BLOCK_SIZE = 1  # Each block is 1 pixel
+SURFACE_PADDING = 40  # Extra padding at the top of the world for sky
+
+# Infinite world settings
+INFINITE_WORLD = False  # Generate columns lazily in chunks instead of a fixed WIDTH-wide world
+CHUNK_WIDTH = 32  # Columns per generated chunk
+MAX_RESIDENT_CHUNKS = 16  # Chunks kept in memory before the least recently used one is dropped
+CHUNK_PRELOAD_MARGIN = CHUNK_WIDTH  # Generate chunks this many columns before the camera reaches them
+
+# World generation
+WORLD_SEED = random.randrange(2**32)  # Every chunk is generated from this seed and its index
+TERRAIN_STREAM, ANCHOR_STREAM, CAVE_STREAM, TREE_STREAM = range(4)  # Independent random streams per chunk
+GENERATION_WORKERS = None  # Processes used to generate large worlds (None uses every core)
+GENERATION_BAND_WIDTH = 8 * CHUNK_WIDTH  # Columns generated by each worker task
+PARALLEL_GENERATION_MIN_WIDTH = 2048  # Smaller worlds generate faster than a pool starts up
+
+# Caves: (top row, bottom row, seeds per chunk, min size, max size, widening chance, gold in the walls)
+CAVE_LAYERS = [
+    (SURFACE_PADDING + 20, HEIGHT * 0.6, 5, 10, 30, 0.5, False),  # Smaller caves in the upper underground
+    (HEIGHT * 0.6, HEIGHT * 0.8, 4, 20, 50, 0.6, True),  # Medium caves in the middle underground
+    (HEIGHT * 0.8, HEIGHT - 10, 2, 40, 100, 0.8, True),  # Very large caves deeper underground
+]
+VECTORIZED_CAVES = False  # Carve every chunk's caves at once with carve_caves instead of generate_caves
+CAVE_WALKERS = 4  # Walkers sent out from each cave seed by carve_caves, sharing the cave's size in steps
+CAVE_BATCH = 64  # Chunks whose caves carve_caves draws and carves at a time
+GOLD_TOP = int(HEIGHT * 0.6)  # Highest row carve_caves puts gold in, the top of the layers with gold
+GOLD_WALL_CHANCE = 0.05  # Chance carve_caves turns a cave wall to gold, like the 1 in 20 of generate_cave_layer
+GOLD_VEIN_CHANCE = 0.3  # Chance a gold wall grows a vein of 1 to 3 more blocks
+CAVERN_WIDTH, CAVERN_HEIGHT = 35, 10  # Largest massive cavern
+NEIGHBOURS = np.array([(0, 1), (1, 0), (0, -1), (-1, 0), (1, 1), (-1, -1), (1, -1), (-1, 1)])  # Sides, then diagonals
+
+# Save files
+SAVE_FILE = "mincraft.sav"  # Written on quit and continued on the next start
+SAVE_COMPRESSED = False  # zlib-compress blocks per chunk (smaller, but can't be memory-mapped)
+SAVE_MAGIC = b"MCSV"
+SAVE_VERSION = 1
+AUTOSAVE_INTERVAL = 30 * 30  # Ticks between autosaves, which append the changed blocks to the save file
+AUTOSAVE_MAX_DELTAS = 100000  # Changed blocks appended before the save file is rewritten instead
+
+# Edit journal
+JOURNAL_CAPACITY = 4096  # Edits the journal holds before it's compacted (or grows if it can't be)
+UNDO_LIMIT = 64  # Player edits that can be undone, older edits are dropped when the journal is compacted
+UNDO_KEY = pyxel.KEY_Z  # Rewinds the world to before the last block mined or placed
+REDO_KEY = pyxel.KEY_Y  # Replays what was undone, until anything else changes
+JOURNAL_ENTRY = np.dtype([("x", np.int64), ("y", np.int16), ("old", np.uint8), ("new", np.uint8),
+                          ("tick", np.uint32), ("player", np.bool_), ("held", np.int8)])
+
+# Lighting
+LIGHTING = True  # Dim blocks by how far light has to travel to them from the sky or a glowing block
+MAX_LIGHT = 12  # Light level of the sky, which drops by one for every block it spreads
+LIGHT_PER_SHADE = 3  # Light levels lost before a block is drawn one colour darker
+DARKER_COLOURS = np.array([0, 0, 1, 5, 2, 1, 12, 13, 2, 4, 9, 3, 5, 5, 8, 9])  # Next darker colour of each pyxel colour
+
+# Overview map
+MIP_LEVELS = 3  # Overview zoom levels, each half the size of the last (2x, 4x and 8x)
+MIP_HEIGHT = -(-HEIGHT // 2**MIP_LEVELS) * 2**MIP_LEVELS  # World height padded with air to halve evenly
+OVERVIEW_KEY = pyxel.KEY_M  # Cycles the view through the overview zoom levels and back
+
+# Pathfinding
+PATH_REGION_WIDTH = 16  # Columns per region, editing a block invalidates the cached paths crossing its region
+PATH_MARGIN = 16  # Columns searched beyond the start and goal
+PATH_MAX_NODES = 4000  # Positions expanded before a search gives up
+PATH_CACHE_SIZE = 256  # Paths kept in the cache
 
 # Block types
 AIR = 0
@@ -24,18 +106,14 @@ IRON_ORE = 7  # Light gray
 GOLD_ORE = 9  # Orange
 DIAMOND_ORE = 3  # Teal
 
-# Block keys (for selecting blocks)
-BLOCK_KEYS = {
-    pyxel.KEY_1: DIRT,
-    pyxel.KEY_2: GRASS,
-    pyxel.KEY_3: STONE,
-    pyxel.KEY_4: SAND,
-    pyxel.KEY_5: WATER,
-    pyxel.KEY_6: COAL_ORE,
-    pyxel.KEY_7: IRON_ORE,
-    pyxel.KEY_8: GOLD_ORE,
-    pyxel.KEY_9: DIAMOND_ORE
-}
+# Hotbar
+HOTBAR_SLOTS = 9  # Stacks the player can carry, drawn left to right in the inventory bar
+STACK_SIZE = 64  # Blocks in a full stack
+STARTING_BLOCKS = [(DIRT, 5), (GRASS, 3)]
+
+# Slot keys (for selecting blocks)
+SLOT_KEYS = [pyxel.KEY_1, pyxel.KEY_2, pyxel.KEY_3, pyxel.KEY_4, pyxel.KEY_5,
+             pyxel.KEY_6, pyxel.KEY_7, pyxel.KEY_8, pyxel.KEY_9]
 
 # Mining times (frames) for each block type
 MINING_TIMES = {
@@ -51,6 +129,18 @@ MINING_TIMES = {
     BEDROCK: 999999  # Effectively unmineable
 }
 
+# Block property tables, indexed by block type
+SOLID = np.ones(256, dtype=bool)  # Blocks the player collides with
+SOLID[[AIR, WATER]] = False
+LIQUID = np.zeros(256, dtype=bool)  # Blocks the player swims in
+LIQUID[WATER] = True
+CARVABLE = np.zeros(256, dtype=bool)  # Blocks caves can be carved through
+CARVABLE[[STONE, DIRT, COAL_ORE, IRON_ORE, GOLD_ORE, DIAMOND_ORE]] = True
+MINING_TIME = np.full(256, 30, dtype=np.int32)  # Frames to mine each block type
+MINING_TIME[list(MINING_TIMES)] = list(MINING_TIMES.values())
+EMITTED_LIGHT = np.zeros(256, dtype=np.uint8)  # Light given off by glowing blocks
+EMITTED_LIGHT[DIAMOND_ORE] = 6
+
 # Player constants
 PLAYER_COLOR = 8  # Pink (color 8)
 PLAYER_HEIGHT = 2  # Player is 2 pixels tall
@@ -61,118 +151,342 @@ WATER_SLOWDOWN = 0.5
 MINING_RANGE = 5  # How far the player can mine from their position
 PLACING_RANGE = 5  # How far the player can place blocks
 
+# Mobs
+PIG, ZOMBIE = range(2)  # Mob kinds
+MOB_COLORS = np.array([14, 2])  # Pink pigs and purple zombies
+MOB_SPEEDS = np.array([0.2, 0.3])  # Blocks walked per tick
+MAX_MOBS = 8  # Mobs alive at once
+MOB_SPAWN_INTERVAL = 60  # Ticks between attempts to spawn a mob
+MOB_SPAWN_DISTANCE = 20  # Columns from the player that mobs spawn at, just out of view
+MOB_DESPAWN_DISTANCE = 48  # Mobs further than this many columns from the player are removed
+MOB_TURN_CHANCE = 0.02  # Chance each tick that a wandering mob changes direction
+ZOMBIE_CHASE_RANGE = 12  # Zombies closer than this to the player walk toward them
+ZOMBIE_REPATH_INTERVAL = 15  # Ticks between a zombie re-planning its path to a player who moved
+MOB_HASH_CELL = 8  # Size of the spatial hash cells used to find mobs near a position
+HASH_KEY_STRIDE = 2**32  # Spatial hash key of cell (x, y) is x * HASH_KEY_STRIDE + y
+
+HEX_DIGITS = np.array(list("0123456789abcdef"))  # Colour characters for Image.set
+
+def darken(colours, steps):
+    """Darken an array of pyxel colours by a number of steps"""
+    for _ in range(steps):
+        colours = DARKER_COLOURS[colours]
+    return colours
+
+# Colour each block is drawn in at each light level, indexed [light, block]
+LIGHT_PALETTE = np.array([darken(np.arange(16), (MAX_LIGHT - level) // LIGHT_PER_SHADE)
+                          for level in range(MAX_LIGHT + 1)], dtype=np.uint8)
+
 # Initialize blocks array
 blocks = np.zeros((WIDTH, HEIGHT), dtype=np.uint8)
 terrain_height = []  # Store the terrain height for collision detection
+surface = np.full(WIDTH, HEIGHT)  # Row of the top solid block in each column, kept up to date by set_block
+dirty_blocks = []  # Positions changed by set_block since the renderer last repainted them
+active_water = set()  # Positions next to recent changes, the only cells the water simulation looks at
+WATER_FLOW_DISTANCE = 8  # How far along a row water looks for somewhere lower to flow to
+awake_blocks = set()  # Positions that may have lost their support, the only cells gravity looks at
+FALLING_LEAVES = False  # Let unsupported grass (tree leaves) fall like sand
 
-# Block being mined data
-mining_block = {
-    "active": False,
-    "x": 0,
-    "y": 0,
-    "type": 0,
-    "progress": 0,
-    "total_time": 0,
-    "flash_state": False,
-    "last_mined_x": -1,  # Track last mined block to prevent repeatedly mining same block
-    "last_mined_y": -1
-}
+def fill_layers(heights, rng=np.random):
+    """Build the dirt, stone and ore bands below a heightmap as one (len(heights), HEIGHT) array"""
+    ys = np.arange(HEIGHT)[np.newaxis, :]
+    heights = np.asarray(heights)[:, np.newaxis]
+    
+    # Create a 5-pixel deep surface layer, stone below it, bedrock (air) on the last row
+    surface_depth = 5
+    stone_start = heights + surface_depth
+    column = np.zeros((heights.shape[0], HEIGHT), dtype=np.uint8)
+    column[(ys >= heights) & (ys < stone_start) & (ys < HEIGHT - 1)] = DIRT
+    stone = (ys >= stone_start) & (ys < HEIGHT - 1)
+    column[stone] = STONE
+    
+    # Add ores with decreasing probability based on depth and value, one roll per cell
+    # (no gold - only in caves)
+    ore_chance = rng.random(column.shape)
+    depth_factor = (ys - stone_start) / (HEIGHT - stone_start - 1)
+    coal = ore_chance < 0.01 + depth_factor * 0.05  # Coal (common)
+    iron = ~coal & (ore_chance < 0.015 + depth_factor * 0.03)  # Iron (less common)
+    diamond = ~coal & ~iron & (ore_chance < 0.018 + depth_factor * 0.01) & (ys > HEIGHT * 0.8)  # Diamond (very rare, deep only)
+    column[stone & coal] = COAL_ORE
+    column[stone & iron] = IRON_ORE
+    column[stone & diamond] = DIAMOND_ORE
+    return column
 
-def generate_terrain():
-    """Generate the terrain with improved features like caves and a proper surface layer"""
-    global terrain_height
-    # Set the base of the world to bedrock
-    blocks[:, HEIGHT-1] = BEDROCK
-    
-    # Create a surface padding area at the top
-    surface_padding = 40  # Extra padding at the top of the world for sky
-    
-    # Generate base terrain height using simplified noise
-    terrain_height = []
-    base_height = surface_padding + (HEIGHT - surface_padding) * 0.4  # Position terrain below the padding
-    
-    # Generate a simple terrain height map
-    prev_height = int(base_height)
-    for x in range(WIDTH):
-        # Small random change from previous height
-        change = random.randint(-1, 1)
-        new_height = prev_height + change
-        
-        # Ensure height stays within reasonable bounds
-        new_height = max(surface_padding, min(HEIGHT - 15, new_height))
-        terrain_height.append(new_height)
-        prev_height = new_height
-    
-    # Fill the terrain based on the height map
-    for x in range(WIDTH):
-        height = terrain_height[x]
-        
-        # Create a 5-pixel deep surface layer
-        surface_depth = 5
-        
-        # Fill below the surface with dirt and stone
-        stone_start = height + surface_depth  # 5 blocks of dirt beneath the surface
-        
-        # Dirt layer (including the surface blocks)
-        for y in range(height, min(stone_start, HEIGHT - 1)):
-            blocks[x, y] = DIRT
-            
-        # Stone layer with occasional ores (no gold - only in caves)
-        for y in range(stone_start, HEIGHT - 1):
-            blocks[x, y] = STONE
-            
-            # Add ores with decreasing probability based on depth and value
-            ore_chance = random.random()
-            depth_factor = (y - stone_start) / (HEIGHT - stone_start - 1)
-            
-            if ore_chance < 0.01 + depth_factor * 0.05:  # Coal (common)
-                blocks[x, y] = COAL_ORE
-            elif ore_chance < 0.015 + depth_factor * 0.03:  # Iron (less common)
-                blocks[x, y] = IRON_ORE
-            elif ore_chance < 0.018 + depth_factor * 0.01 and y > HEIGHT * 0.8:  # Diamond (very rare, deep only)
-                blocks[x, y] = DIAMOND_ORE
-            # No gold generation here - gold will only be in caves
+def chunk_rng(seed, index, stream=TERRAIN_STREAM):
+    """NumPy random generator for one chunk, derived only from the world seed, chunk index and stream"""
+    return np.random.default_rng([seed, index % 2**32, stream])
+
+def chunk_random(seed, index, stream):
+    """random.Random for one chunk's feature generators, derived the same way as chunk_rng"""
+    return random.Random(int(chunk_rng(seed, index, stream).integers(2**63)))
+
+def chunk_anchor_height(seed, index):
+    """Surface height at the first column of a chunk, shared by the chunk and its left neighbour"""
+    base_height = int(SURFACE_PADDING + (HEIGHT - SURFACE_PADDING) * 0.4)
+    return base_height + int(chunk_rng(seed, index, ANCHOR_STREAM).integers(-8, 9))
+
+def generate_chunk_terrain(seed, index):
+    """Generate the surface heights and the dirt, stone, ore and grass layers of one chunk"""
+    rng = chunk_rng(seed, index)
     
-    # Add caves - ensure they start below terrain surface
-    generate_caves(surface_padding)
+    # Random-walk from this chunk's anchor height to the next chunk's, so neighbouring
+    # chunks line up without either one having to be generated first
+    start = chunk_anchor_height(seed, index)
+    rise = chunk_anchor_height(seed, index + 1) - start
+    steps = rng.integers(-1, 2, size=CHUNK_WIDTH)
+    while steps.sum() != rise:
+        direction = 1 if steps.sum() < rise else -1
+        candidates = np.flatnonzero(steps != direction)
+        count = min(abs(rise - int(steps.sum())), candidates.size)
+        steps[rng.choice(candidates, count, replace=False)] += direction
+    heights = start + np.concatenate(([0], np.cumsum(steps[:-1])))
+    heights = np.clip(heights, SURFACE_PADDING, HEIGHT - 15)
     
-    # Add surface features (grass and trees)
-    generate_surface_features()
+    chunk = fill_layers(heights, rng)
+    # Make the top dirt block grass
+    chunk[np.arange(CHUNK_WIDTH), heights] = GRASS
+    return heights, chunk
 
-def generate_caves(surface_padding):
-    """Generate cave systems underground"""
-    # Make sure caves start below the terrain surface
-    min_cave_y = surface_padding + 20  # Ensure caves start well below the surface
+def generate_columns(seed, x_start, x_end):
+    """Generate the finished blocks for world columns x_start to x_end"""
+    first = x_start // CHUNK_WIDTH - 1  # Chunks whose features can reach the range
+    last = (x_end - 1) // CHUNK_WIDTH + 1
+    terrain = [generate_chunk_terrain(seed, index) for index in range(first - 1, last + 2)]
+    heights = np.concatenate([chunk_heights for chunk_heights, _ in terrain])
+    pristine = np.concatenate([chunk for _, chunk in terrain])
+    area = pristine.copy()
+    carved = np.zeros(area.shape, dtype=bool)
     
-    # First, generate smaller caves in the upper underground (but below surface)
-    generate_cave_layer(min_cave_y, HEIGHT * 0.6, 25, 10, 30, 0.5, False)
+    if VECTORIZED_CAVES:
+        caves, gold = carve_caves(pristine, heights, seed, first - 1)
+        area[gold] = GOLD_ORE
+        carved[caves] = True
     
-    # Generate medium caves in the middle underground
-    generate_cave_layer(HEIGHT * 0.6, HEIGHT * 0.8, 20, 20, 50, 0.6, True)
+    for offset, index in enumerate(range(first, last + 1)):
+        # Grow this chunk's features on its own copy of the chunks around it
+        window = slice(offset * CHUNK_WIDTH, (offset + 3) * CHUNK_WIDTH)
+        features = pristine[window].copy()
+        if not VECTORIZED_CAVES:
+            generate_caves(features, heights[window], chunk_random(seed, index, CAVE_STREAM),
+                           CHUNK_WIDTH, 2 * CHUNK_WIDTH)
+        generate_trees(features, chunk_random(seed, index, TREE_STREAM),
+                       CHUNK_WIDTH, 2 * CHUNK_WIDTH)
+        
+        changed = features != pristine[window]
+        area[window][changed] = features[changed]
+        carved[window] |= changed & (features == AIR)
     
-    # Then, generate very large caves deeper underground
-    generate_cave_layer(HEIGHT * 0.8, HEIGHT - 10, 10, 40, 100, 0.8, True)
+    # Caves always win over ore and gold placed by a neighbouring chunk's features
+    area[carved] = AIR
+    start = x_start - (first - 1) * CHUNK_WIDTH
+    return area[start:start + x_end - x_start], heights[start:start + x_end - x_start]
+
+def generate_chunk(seed, index):
+    """Generate the CHUNK_WIDTH x HEIGHT blocks of one chunk of an infinite world"""
+    chunk, _ = generate_columns(seed, index * CHUNK_WIDTH, (index + 1) * CHUNK_WIDTH)
+    return chunk
+
+def generate_band(seed, x_start, x_end, shared_name, shape):
+    """Worker task: generate columns x_start to x_end straight into the shared world array"""
+    shared = shared_memory.SharedMemory(name=shared_name)
+    try:
+        world = np.ndarray(shape, dtype=np.uint8, buffer=shared.buf)
+        world[x_start:x_end], heights = generate_columns(seed, x_start, x_end)
+        del world  # Release the view so the shared memory can close
+    finally:
+        shared.close()
+    return heights
+
+def generate_columns_parallel(seed, x_start, x_end, workers=GENERATION_WORKERS):
+    """Generate columns x_start to x_end in bands across a process pool.
+    
+    Each band is generated with its own overlap margin by generate_columns, so the
+    stitched result is identical to generating the whole range in one go.
+    """
+    width = x_end - x_start
+    workers = workers or os.cpu_count() or 1
+    # A single core or a range of one band gains nothing from a pool, which only adds its start-up
+    if (ProcessPoolExecutor is None or workers == 1 or width < PARALLEL_GENERATION_MIN_WIDTH
+            or width <= GENERATION_BAND_WIDTH):
+        return generate_columns(seed, x_start, x_end)
+    
+    bands = [(band_start, min(band_start + GENERATION_BAND_WIDTH, width))
+             for band_start in range(0, width, GENERATION_BAND_WIDTH)]
+    shape = (width, HEIGHT)
+    shared = shared_memory.SharedMemory(create=True, size=width * HEIGHT)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(generate_band, seed, x_start + band_start, x_start + band_end,
+                                   shared.name, shape)
+                       for band_start, band_end in bands]
+            heights = np.concatenate([future.result() for future in futures])
+        area = np.ndarray(shape, dtype=np.uint8, buffer=shared.buf).copy()
+    finally:
+        shared.close()
+        shared.unlink()
+    return area, heights
+
+def generate_terrain():
+    """Generate the terrain with improved features like caves and a proper surface layer"""
+    global blocks, terrain_height, surface
+    # The base of the world is bedrock, caves start below the terrain surface and
+    # trees grow on the grass
+    blocks, terrain_height = generate_columns_parallel(WORLD_SEED, 0, WIDTH)
+    surface = surface_heights(blocks)
+
+def surface_heights(area):
+    """Find the row of the top solid block in every column at once (HEIGHT for empty columns)"""
+    solid = area != AIR
+    return np.where(solid.any(axis=1), solid.argmax(axis=1), HEIGHT)
+
+def update_surface(tops, column, x, y, block):
+    """Keep a surface index right after block y of column x changed"""
+    if block != AIR:
+        if y < tops[x]:
+            tops[x] = y
+    elif y == tops[x]:
+        # The top block was removed, the new top is the next solid block below it
+        below = column[y + 1:] != AIR
+        tops[x] = y + 1 + below.argmax() if below.any() else HEIGHT
+
+def generate_caves(area, heights, rng, x_start, x_end):
+    """Generate cave systems underground, seeded in columns x_start to x_end of the area"""
+    # Cave seeds per chunk keep the density of the original 160-column world, in layers
+    # of bigger caves going down from well below the surface
+    for layer in CAVE_LAYERS:
+        generate_cave_layer(area, heights, rng, x_start, x_end, *layer)
     
     # Finally, generate a few massive caverns
-    generate_large_caverns()
+    generate_large_caverns(area, rng, x_start, x_end)
+    
+def sorted_unique(keys):
+    """The distinct values of an integer array, sorted (np.unique without the hashing)"""
+    keys = np.sort(keys)
+    first = np.ones(keys.shape, dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return keys[first]
+
+def stacked_random(rngs, shape):
+    """The next random numbers of each of a list of generators, stacked into one array"""
+    return np.stack([rng.random(shape, dtype=np.float32) for rng in rngs])
+
+def carve_caves(pristine, heights, seed, first):
+    """Carve the caves of every chunk of an area starting at chunk first, returning masks of its cave and gold blocks"""
+    width = pristine.shape[0]
+    reached = np.zeros((width + 2 * CHUNK_WIDTH, HEIGHT), dtype=bool)  # Cells caves reach, from a chunk before the area
+    cells = reached.reshape(-1)  # The same, indexed by x * HEIGHT + y
+    all_rngs = [chunk_rng(seed, first + chunk, CAVE_STREAM) for chunk in range(width // CHUNK_WIDTH)]
+    
+    for batch in range(0, len(all_rngs), CAVE_BATCH):
+        rngs = all_rngs[batch:batch + CAVE_BATCH]
+        chunks = np.arange(batch, batch + len(rngs))
+        low = chunks * CHUNK_WIDTH  # Start of each chunk's three-chunk window in reached
+        
+        for min_y, max_y, num_seeds, min_size, max_size, width_chance, _ in CAVE_LAYERS:
+            steps = -(-max_size // CAVE_WALKERS)
+            shape = (len(chunks), num_seeds, CAVE_WALKERS, steps)
+            seeds = stacked_random(rngs, (num_seeds, 3))
+            directions, widen, shafts = (stacked_random(rngs, shape[1:] + extra) for extra in ((), (8,), (2,)))
+            
+            # Seed in the chunk's own columns, in stone or dirt like generate_cave_layer
+            seed_x = low[:, None] + CHUNK_WIDTH + (seeds[..., 0] * CHUNK_WIDTH).astype(int)
+            seed_y = int(min_y) + (seeds[..., 1] * (int(max_y) - int(min_y) + 1)).astype(int)
+            sizes = int(min_size) + (seeds[..., 2] * (max_size - min_size + 1)).astype(int)
+            seeded = (pristine[seed_x - CHUNK_WIDTH, seed_y] == STONE) | (pristine[seed_x - CHUNK_WIDTH, seed_y] == DIRT)
+            
+            # Walk every walker at once, kept in the window and below the surface
+            moves = NEIGHBOURS[(directions * 4).astype(int)]
+            window_low = np.broadcast_to(low[:, None, None, None], shape)
+            xs = np.clip(seed_x[..., None, None] + np.cumsum(moves[..., 0], axis=-1),
+                         window_low, window_low + 3 * CHUNK_WIDTH - 1)
+            ys = np.clip(seed_y[..., None, None] + np.cumsum(moves[..., 1], axis=-1),
+                         heights[np.clip(xs - CHUNK_WIDTH, 0, width - 1)] + 1, HEIGHT - 2)
+            walked = np.broadcast_to(seeded[..., None, None] &
+                                     (np.arange(steps) < -(-sizes // CAVE_WALKERS)[..., None, None]), shape)
+            path_x, path_y, path_low = xs[walked], ys[walked], window_low[walked]
+            path = path_x * HEIGHT + path_y
+            
+            # Widen the paths, diagonally too in the deeper part of the layer, staying in the window
+            widened = widen[walked] < width_chance
+            widened[:, 4:] &= (path_y > max_y * 0.7)[:, None]
+            widened[:, NEIGHBOURS[:, 0] < 0] &= (path_x > path_low)[:, None]
+            widened[:, NEIGHBOURS[:, 0] > 0] &= (path_x < path_low + 3 * CHUNK_WIDTH - 1)[:, None]
+            
+            # The deepest caves sometimes open up shafts 2 to 4 blocks high
+            shaft = shafts[walked]
+            shafted = (shaft[:, 0] < 0.15) & (path_y > HEIGHT * 0.85)
+            shaft_height = np.where(shafted, 2 + (shaft[:, 1] * 3).astype(int), 0)
+            cells[seed_x[seeded] * HEIGHT + seed_y[seeded]] = True
+            cells[path] = True
+            cells[(path[:, None] + NEIGHBOURS[:, 0] * HEIGHT + NEIGHBOURS[:, 1])[widened]] = True
+            for rise in range(1, 5):
+                cells[path[shaft_height >= rise] - rise] = True
+        
+        # A massive cavern in about half of the chunks, an ellipse with ragged edges
+        caverns, noise = stacked_random(rngs, 5), stacked_random(rngs, (CAVERN_WIDTH, CAVERN_HEIGHT))
+        center_x = low + CHUNK_WIDTH + (caverns[:, 1] * CHUNK_WIDTH).astype(int)
+        center_y = int(HEIGHT * 0.85) + (caverns[:, 2] * (HEIGHT - 15 - int(HEIGHT * 0.85) + 1)).astype(int)
+        cavern_width = (20 + (caverns[:, 3] * 16).astype(int))[:, None, None]
+        cavern_height = (6 + (caverns[:, 4] * 5).astype(int))[:, None, None]
+        dx = (np.arange(CAVERN_WIDTH) - CAVERN_WIDTH // 2)[None, :, None]
+        dy = (np.arange(CAVERN_HEIGHT) - CAVERN_HEIGHT // 2)[None, None, :]
+        in_cavern = ((caverns[:, 0] < 0.5)[:, None, None] &
+                     (dx >= -(cavern_width // 2)) & (dx < cavern_width // 2) &
+                     (dy >= -(cavern_height // 2)) & (dy < cavern_height // 2) &
+                     ((dx / (cavern_width / 2)) ** 2 + (dy / (cavern_height / 2)) ** 2 + noise * 0.3 - 0.1 <= 1.0))
+        reached[np.broadcast_to(center_x[:, None, None] + dx, in_cavern.shape)[in_cavern],
+                np.broadcast_to(center_y[:, None, None] + dy, in_cavern.shape)[in_cavern]] = True
     
-def generate_large_caverns():
-    """Generate a few massive caverns (up to 10 pixels high) in the deep underground"""
-    # Create 2-3 massive caverns
-    num_caverns = random.randint(2, 3)
+    # Caves carve the stone and dirt below the surface they reach in the area
+    rows = np.arange(HEIGHT)
+    carved = (reached[CHUNK_WIDTH:CHUNK_WIDTH + width] & CARVABLE[pristine] &
+              (rows > heights[:, None]) & (rows < HEIGHT - 1))
+    
+    # Gold in some of the stone walls of the deeper caves, a few growing a short vein
+    stone = (pristine == STONE) & ~carved
+    around = np.pad(carved[:, GOLD_TOP - 1:], 1)
+    wall = np.zeros((width, HEIGHT - GOLD_TOP), dtype=bool)
+    for side_x, side_y in NEIGHBOURS:
+        wall |= around[1 + side_x:width + 1 + side_x, 2 + side_y:HEIGHT - GOLD_TOP + 2 + side_y]
+    xs, ys = np.nonzero(stone[:, GOLD_TOP:] & wall)
+    ys += GOLD_TOP
+    
+    # Each wall's rolls come from the stream of the chunk it's in, in column order
+    counts = np.bincount(xs // CHUNK_WIDTH, minlength=len(all_rngs)).tolist()
+    rolls = np.concatenate([rng.random((count, 5), dtype=np.float32) for rng, count in zip(all_rngs, counts)])
+    gold = np.zeros(pristine.shape, dtype=bool)
+    seeded = rolls[:, 0] < GOLD_WALL_CHANCE
+    gold[xs[seeded], ys[seeded]] = True
+    xs, ys, rolls = xs[seeded], ys[seeded], rolls[seeded]
+    vein_length = np.where(rolls[:, 1] < GOLD_VEIN_CHANCE, 1 + (rolls[:, 1] * 10).astype(int), 0)
+    chunks = xs // CHUNK_WIDTH  # Veins stay in their chunk, whose walls are the same however the area is cut
+    for step in range(3):
+        direction = NEIGHBOURS[(rolls[:, 2 + step] * 4).astype(int)]
+        xs, ys = xs + direction[:, 0], ys + direction[:, 1]
+        growing = (step < vein_length) & (xs // CHUNK_WIDTH == chunks) & (ys < HEIGHT)
+        growing[growing] = stone[xs[growing], ys[growing]]
+        gold[xs[growing], ys[growing]] = True
+        vein_length = np.where(growing, vein_length, 0)
+    return carved, gold
+
+def generate_large_caverns(area, rng, x_start, x_end):
+    """Generate massive caverns (up to 10 pixels high) in the deep underground"""
+    # Create a massive cavern in about half of the chunks (2-3 per 160 columns)
+    num_caverns = 1 if rng.random() < 0.5 else 0
+    width_limit = area.shape[0]
     
     for _ in range(num_caverns):
         # Place seed in deep area
-        seed_x = random.randint(20, WIDTH - 20)
-        seed_y = random.randint(int(HEIGHT * 0.85), HEIGHT - 15)
+        seed_x = rng.randint(x_start, x_end - 1)
+        seed_y = rng.randint(int(HEIGHT * 0.85), HEIGHT - 15)
         
         # Define cavern size (horizontal and vertical)
-        width = random.randint(20, 35)
-        height = random.randint(6, 10)  # Caves up to 10 blocks high
+        width = rng.randint(20, 35)
+        height = rng.randint(6, 10)  # Caves up to 10 blocks high
         
         # Create the main cavern chamber
         for x in range(seed_x - width // 2, seed_x + width // 2):
-            if x < 0 or x >= WIDTH:
+            if x < 0 or x >= width_limit:
                 continue
                 
             for y in range(seed_y - height // 2, seed_y + height // 2):
@@ -185,26 +499,30 @@ def generate_large_caverns():
                 
                 # Use elliptical equation to create natural cavern shape
                 # Add randomness to make edges less perfect
-                if dx*dx + dy*dy + random.uniform(-0.1, 0.2) <= 1.0:
-                    blocks[x, y] = AIR
+                if dx*dx + dy*dy + rng.uniform(-0.1, 0.2) <= 1.0:
+                    area[x, y] = AIR
                     
                     # Add gold in the walls of the cavern (only on stone blocks)
-                    if random.random() < 0.04:  # 4% chance for gold in large caverns
+                    if rng.random() < 0.04:  # 4% chance for gold in large caverns
                         # Check adjacent blocks for potential gold placement
                         for nx, ny in [(x+1, y), (x-1, y), (x, y+1), (x, y-1)]:
-                            if (0 <= nx < WIDTH and 0 <= ny < HEIGHT - 1 and 
-                                blocks[nx, ny] == STONE):
-                                blocks[nx, ny] = GOLD_ORE
+                            if (0 <= nx < width_limit and 0 <= ny < HEIGHT - 1 and 
+                                area[nx, ny] == STONE):
+                                area[nx, ny] = GOLD_ORE
                                 break
     
-def generate_cave_layer(min_y, max_y, num_seeds, min_size, max_size, width_chance, add_gold):
+def generate_cave_layer(area, heights, rng, x_start, x_end, min_y, max_y, num_seeds, min_size, max_size, width_chance, add_gold):
     """Generate cave systems in a specific layer of the underground"""
+    width_limit = area.shape[0]
+    heights = heights.tolist()  # Python lists index far faster than numpy in the loops below
+    carvable = CARVABLE.tolist()
+    
     # Randomly place cave seeds
     cave_seeds = []
     for _ in range(num_seeds):  # Number of cave seeds
-        x = random.randint(5, WIDTH - 5)
+        x = rng.randint(x_start, x_end - 1)
         # Caves start in the specified section of the underground
-        y = random.randint(int(min_y), int(max_y))
+        y = rng.randint(int(min_y), int(max_y))
         cave_seeds.append((x, y))
     
     # For each seed, grow a cave in random directions
@@ -212,36 +530,36 @@ def generate_cave_layer(min_y, max_y, num_seeds, min_size, max_size, width_chanc
     
     for seed_x, seed_y in cave_seeds:
         # Skip if seed is not in stone
-        if blocks[seed_x, seed_y] != STONE and blocks[seed_x, seed_y] != DIRT:
+        if area[seed_x, seed_y] != STONE and area[seed_x, seed_y] != DIRT:
             continue
             
         # Start with the seed
         cave_points = [(seed_x, seed_y)]
-        blocks[seed_x, seed_y] = AIR
+        area[seed_x, seed_y] = AIR
         all_cave_blocks.append((seed_x, seed_y))
         
         # Grow the cave
-        cave_size = random.randint(int(min_size), int(max_size))  # Size of this cave system
+        cave_size = rng.randint(int(min_size), int(max_size))  # Size of this cave system
         for _ in range(cave_size):
             if not cave_points:  # If we've hit a dead end
                 break
                 
             # Pick a random existing cave point to grow from
-            point_idx = random.randint(0, len(cave_points) - 1)
+            point_idx = rng.randrange(len(cave_points))  # Same draw as randint(0, len - 1), with less overhead
             x, y = cave_points[point_idx]
             
             # Try to grow in a random direction
             directions = [(0, 1), (1, 0), (0, -1), (-1, 0)]
-            random.shuffle(directions)
+            rng.shuffle(directions)
             
             for dx, dy in directions:
                 new_x, new_y = x + dx, y + dy
                 
                 # Check bounds
-                if 0 <= new_x < WIDTH and terrain_height[new_x] < new_y < HEIGHT - 1:
+                if 0 <= new_x < width_limit and heights[new_x] < new_y < HEIGHT - 1:
                     # Only carve through stone or dirt, not surface or bedrock
-                    if blocks[new_x, new_y] in [STONE, DIRT, COAL_ORE, IRON_ORE, GOLD_ORE, DIAMOND_ORE]:
-                        blocks[new_x, new_y] = AIR
+                    if carvable[area[new_x, new_y]]:
+                        area[new_x, new_y] = AIR
                         cave_points.append((new_x, new_y))
                         all_cave_blocks.append((new_x, new_y))
                         
@@ -254,20 +572,20 @@ def generate_cave_layer(min_y, max_y, num_seeds, min_size, max_size, width_chanc
                                                (new_x+1, new_y-1), (new_x-1, new_y+1)])
                         
                         # For the deepest caves, occasionally create vertical expansions up to 3-4 blocks high
-                        if y > HEIGHT * 0.85 and random.random() < 0.15:
+                        if y > HEIGHT * 0.85 and rng.random() < 0.15:
                             # Create vertical shaft
-                            vert_height = random.randint(2, 4)
+                            vert_height = rng.randint(2, 4)
                             for vy in range(1, vert_height + 1):
                                 if 0 <= new_y - vy < HEIGHT - 1:
-                                    blocks[new_x, new_y - vy] = AIR
+                                    area[new_x, new_y - vy] = AIR
                                     all_cave_blocks.append((new_x, new_y - vy))
                         
                         for nx, ny in width_blocks:
-                            if (0 <= nx < WIDTH and terrain_height[nx] < ny < HEIGHT - 1 and 
-                                blocks[nx, ny] in [STONE, DIRT, COAL_ORE, IRON_ORE, GOLD_ORE, DIAMOND_ORE]):
+                            if (0 <= nx < width_limit and heights[nx] < ny < HEIGHT - 1 and 
+                                carvable[area[nx, ny]]):
                                 # Chance to expand width (higher for deeper caves)
-                                if random.random() < width_chance:
-                                    blocks[nx, ny] = AIR
+                                if rng.random() < width_chance:
+                                    area[nx, ny] = AIR
                                     all_cave_blocks.append((nx, ny))
                         break
     
@@ -279,93 +597,65 @@ def generate_cave_layer(min_y, max_y, num_seeds, min_size, max_size, width_chanc
             # Check adjacent blocks to find cave walls
             for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0), (1, 1), (-1, -1), (1, -1), (-1, 1)]:
                 wall_x, wall_y = cave_x + dx, cave_y + dy
-                if (0 <= wall_x < WIDTH and terrain_height[wall_x] < wall_y < HEIGHT - 1 and 
-                    blocks[wall_x, wall_y] == STONE):  # Only replace stone with gold
+                if (0 <= wall_x < width_limit and heights[wall_x] < wall_y < HEIGHT - 1 and 
+                    area[wall_x, wall_y] == STONE):  # Only replace stone with gold
                     cave_walls.append((wall_x, wall_y))
         
         # Place gold in some of the cave walls (more densely in deeper caves)
         num_gold_deposits = len(cave_walls) // 20  # About 5% of cave walls will have gold
         if cave_walls and num_gold_deposits > 0:
-            gold_positions = random.sample(cave_walls, min(num_gold_deposits, len(cave_walls)))
+            gold_positions = rng.sample(cave_walls, min(num_gold_deposits, len(cave_walls)))
             for gold_x, gold_y in gold_positions:
-                blocks[gold_x, gold_y] = GOLD_ORE
+                area[gold_x, gold_y] = GOLD_ORE
                 
                 # Create small gold veins for some deposits (1-3 connected blocks)
-                if random.random() < 0.3:  # 30% chance for a vein
-                    vein_size = random.randint(1, 3)
+                if rng.random() < 0.3:  # 30% chance for a vein
+                    vein_size = rng.randint(1, 3)
                     for _ in range(vein_size):
                         # Find adjacent stone blocks
                         adjacent_blocks = []
                         for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
                             adj_x, adj_y = gold_x + dx, gold_y + dy
-                            if (0 <= adj_x < WIDTH and terrain_height[adj_x] < adj_y < HEIGHT - 1 and 
-                                blocks[adj_x, adj_y] == STONE):
+                            if (0 <= adj_x < width_limit and heights[adj_x] < adj_y < HEIGHT - 1 and 
+                                area[adj_x, adj_y] == STONE):
                                 adjacent_blocks.append((adj_x, adj_y))
                         
                         # Add gold to a random adjacent block if possible
                         if adjacent_blocks:
-                            next_x, next_y = random.choice(adjacent_blocks)
-                            blocks[next_x, next_y] = GOLD_ORE
+                            next_x, next_y = rng.choice(adjacent_blocks)
+                            area[next_x, next_y] = GOLD_ORE
                             gold_x, gold_y = next_x, next_y  # Continue vein from this new point
 
-def generate_surface_features():
-    """Generate surface features - add grass on top and trees"""
-    # Add grass to the top layer of dirt
-    for x in range(WIDTH):
-        # Find the top dirt block
-        for y in range(HEIGHT):
-            if blocks[x, y] == DIRT:
-                # Make the top dirt block grass
-                blocks[x, y] = GRASS
-                break
+def generate_trees(area, rng, x_start, x_end):
+    """Generate trees on the grass surface, rooted in columns x_start to x_end of the area"""
+    width_limit = area.shape[0]
     
-    # Add trees on the grass
-    generate_trees()
-
-def generate_trees():
-    """Generate trees on the grass surface"""
     # Find suitable spots for trees (grass blocks with space above)
-    potential_tree_spots = []
-    
-    for x in range(5, WIDTH - 5):  # Stay away from edges
-        # Check if this is a suitable spot for a tree
-        for y in range(HEIGHT):
-            if blocks[x, y] == GRASS and all(blocks[x, y-i] == AIR for i in range(1, 8)):
-                # We found a grass block with 7 air blocks above it
-                # Check if there's enough flat area for a tree (at least 3 blocks wide)
-                is_flat = True
-                for i in range(-1, 2):
-                    if x + i < 0 or x + i >= WIDTH:
-                        is_flat = False
-                        break
-                    # Find the top block for this column
-                    for cy in range(HEIGHT):
-                        if blocks[x + i, cy] != AIR:
-                            # Check if it's close to our current height
-                            if abs(cy - y) > 1:
-                                is_flat = False
-                            break
-                
-                if is_flat:
-                    potential_tree_spots.append((x, y))
-                break  # Only check the topmost grass block
+    tops = surface_heights(area)
+    xs = np.arange(max(x_start, 1), min(x_end, width_limit - 1))  # Stay away from edges
+    ys = tops[xs]
+    # The top block must be grass with 7 air blocks above it, and there must be enough
+    # flat area for a tree (neighbouring tops within one block, at least 3 blocks wide)
+    suitable = ((ys >= 7) & (ys < HEIGHT) & (area[xs, np.minimum(ys, HEIGHT - 1)] == GRASS) &
+                (np.abs(tops[xs - 1] - ys) <= 1) & (np.abs(tops[xs + 1] - ys) <= 1))
+    potential_tree_spots = list(zip(xs[suitable].tolist(), ys[suitable].tolist()))
     
     # Place trees at some of the potential spots
-    num_trees = min(len(potential_tree_spots) // 2, 15)  # Place more trees
+    num_trees = min(len(potential_tree_spots) // 2, 3)  # About 15 trees per 160 columns
     
     # Randomly select spots for trees
     if potential_tree_spots:
-        tree_spots = random.sample(potential_tree_spots, min(num_trees, len(potential_tree_spots)))
+        tree_spots = rng.sample(potential_tree_spots, min(num_trees, len(potential_tree_spots)))
         
         for x, surface_y in tree_spots:
             # Tree height (2-5 blocks)
-            tree_height = random.randint(3, 5)
+            tree_height = rng.randint(3, 5)
             
             # Create trunk (dirt blocks)
             for y in range(1, tree_height):
                 tree_y = surface_y - y
                 if 0 <= tree_y < HEIGHT:
-                    blocks[x, tree_y] = DIRT
+                    area[x, tree_y] = DIRT
             
             # Create leaves (grass blocks in a triangle shape)
             leaf_width = min(3, tree_height - 1)
@@ -382,10 +672,1059 @@ def generate_trees():
                 # Place leaves
                 for i in range(-half_width, half_width + 1):
                     leaf_x = x + i
-                    if 0 <= leaf_x < WIDTH and 0 <= leaf_y < HEIGHT:
+                    if 0 <= leaf_x < width_limit and 0 <= leaf_y < HEIGHT:
                         # Only replace air or overwrite other leaves
-                        if blocks[leaf_x, leaf_y] == AIR or blocks[leaf_x, leaf_y] == GRASS:
-                            blocks[leaf_x, leaf_y] = GRASS
+                        if area[leaf_x, leaf_y] == AIR or area[leaf_x, leaf_y] == GRASS:
+                            area[leaf_x, leaf_y] = GRASS
+
+class ChunkCache:
+    """Something kept a chunk of columns at a time, made on first read, only the most recently used kept"""
+    def __init__(self, make, evicted=None, max_resident=MAX_RESIDENT_CHUNKS):
+        self.make = make  # Makes a chunk from its index
+        self.evicted = evicted  # Told the index of every chunk dropped
+        self.max_resident = max_resident
+        self.chunks = OrderedDict()  # Chunk index -> chunk, least recently used first
+    
+    def __contains__(self, index):
+        return index in self.chunks
+    
+    def __getitem__(self, index):
+        chunk = self.chunks.get(index)
+        if chunk is None:
+            chunk = self.chunks[index] = self.make(index)
+            if len(self.chunks) > self.max_resident:
+                dropped, _ = self.chunks.popitem(last=False)
+                if self.evicted is not None:
+                    self.evicted(dropped)
+        else:
+            self.chunks.move_to_end(index)
+        return chunk
+    
+    def clear(self):
+        self.chunks.clear()
+
+def stitch_columns(chunk, x_start, x_end, rows, width=CHUNK_WIDTH):
+    """Columns x_start to x_end of an array kept as chunk(index) arrays of width columns each"""
+    return np.concatenate([
+        chunk(index)[max(x_start - index * width, 0):x_end - index * width, rows]
+        for index in range(x_start // width, (x_end - 1) // width + 1)
+    ])
+
+def gather_cells(chunk, xs, ys, width=CHUNK_WIDTH):
+    """Cells at arrays of positions of an array kept as chunk(index) arrays, like array[xs, ys]"""
+    result = np.empty(xs.shape, dtype=np.uint8)
+    indices = xs // width
+    for index in np.unique(indices).tolist():
+        in_chunk = indices == index
+        result[in_chunk] = chunk(index)[xs[in_chunk] - index * width, ys[in_chunk]]
+    return result
+
+class ChunkedWorld:
+    """Block storage for an infinite world, read and written like the blocks array.
+    
+    Chunks are generated on first access and only the most recently used ones are kept.
+    An evicted chunk is regenerated from the seed when revisited, with the player's
+    edits to it replayed on top.
+    """
+    def __init__(self, seed, max_resident=MAX_RESIDENT_CHUNKS):
+        self.seed = seed
+        self.chunks = ChunkCache(self.generate, self.surfaces_evicted, max_resident)
+        self.surfaces = {}  # Chunk index -> top solid block row of each of its columns
+        self.edits = {}  # Chunk index -> {(local x, y): block} of blocks changed by the player
+        self.last_index = None  # Most recent chunk, skips the LRU bookkeeping for repeat reads
+        self.last_chunk = None
+    
+    def chunk(self, index):
+        """Get the blocks of a chunk, generating it if it isn't resident"""
+        if index != self.last_index:
+            self.last_chunk = self.chunks[index]
+            self.last_index = index
+        return self.last_chunk
+    
+    def generate(self, index):
+        # Regenerate a chunk with the player's edits to it
+        chunk = generate_chunk(self.seed, index)
+        for (x, y), block in self.edits.get(index, {}).items():
+            chunk[x, y] = block
+        self.surfaces[index] = surface_heights(chunk)
+        return chunk
+    
+    def surfaces_evicted(self, index):
+        del self.surfaces[index]
+    
+    def preload(self, x_start, x_end):
+        """Make sure the chunks covering columns x_start to x_end are resident"""
+        for index in range(x_start // CHUNK_WIDTH, x_end // CHUNK_WIDTH + 1):
+            self.chunk(index)
+    
+    def __getitem__(self, position):
+        x, y = position
+        if isinstance(x, slice):
+            # Column ranges (as drawn by the renderer) are stitched together from their chunks
+            return stitch_columns(self.chunk, x.start, x.stop, y)
+        return self.chunk(x // CHUNK_WIDTH)[x % CHUNK_WIDTH, y]
+    
+    def __setitem__(self, position, block):
+        x, y = position
+        index, local_x = divmod(x, CHUNK_WIDTH)
+        chunk = self.chunk(index)
+        chunk[local_x, y] = block
+        update_surface(self.surfaces[index], chunk[local_x], local_x, y, block)
+        self.edits.setdefault(index, {})[(local_x, y)] = block
+    
+    def surface_top(self, x):
+        """Row of the top solid block in column x"""
+        index, local_x = divmod(x, CHUNK_WIDTH)
+        self.chunk(index)
+        return int(self.surfaces[index][local_x])
+    
+    def take(self, xs, ys):
+        """Read the blocks at arrays of positions, like blocks[xs, ys] on an array"""
+        return gather_cells(self.chunk, xs, ys)
+
+def read_columns(x_start, x_end):
+    """Copy the blocks of columns x_start to x_end, beyond the edges of a finite world is stone"""
+    if INFINITE_WORLD:
+        return blocks[x_start:x_end, :]
+    area = np.full((x_end - x_start, HEIGHT), STONE, dtype=np.uint8)
+    inside_start, inside_end = max(x_start, 0), min(x_end, WIDTH)
+    if inside_start < inside_end:
+        area[inside_start - x_start:inside_end - x_start] = blocks[inside_start:inside_end]
+    return area
+
+def light_columns(x_start, x_end):
+    """Flood light over columns x_start to x_end from the sky and glowing blocks.
+    
+    A breadth-first flood done one light level at a time, brightest first: every block
+    at the current level that lets light through lights its neighbours one level dimmer.
+    Solid blocks are lit but stop the light. Blocks above the surface are lit by the sky.
+    The blocks read are MAX_LIGHT columns wider on each side, as light spreads that far.
+    """
+    area = read_columns(x_start - MAX_LIGHT, x_end + MAX_LIGHT)
+    sky = np.arange(HEIGHT) < surface_heights(area)[:, None]
+    light = np.maximum(np.where(sky, MAX_LIGHT, 0), EMITTED_LIGHT[area]).astype(np.uint8)
+    passes_light = ~SOLID[area] | (EMITTED_LIGHT[area] > 0)
+    for level in range(MAX_LIGHT, 1, -1):
+        spreading = passes_light & (light == level)
+        reached = np.zeros_like(spreading)
+        reached[1:] |= spreading[:-1]
+        reached[:-1] |= spreading[1:]
+        reached[:, 1:] |= spreading[:, :-1]
+        reached[:, :-1] |= spreading[:, 1:]
+        light[reached & (light < level - 1)] = level - 1
+    return light[MAX_LIGHT:-MAX_LIGHT]
+
+class LightMap:
+    """Light levels of the blocks, lit a chunk of columns at a time as they are read.
+    
+    Light fades by one level per block, so a column's light only depends on the blocks
+    within MAX_LIGHT columns of it. A changed block marks its column stale and update
+    relights just the columns it can reach, once per frame however many blocks changed.
+    """
+    def __init__(self, max_resident=MAX_RESIDENT_CHUNKS):
+        self.chunks = ChunkCache(lambda index: light_columns(index * CHUNK_WIDTH, (index + 1) * CHUNK_WIDTH),
+                                 max_resident=max_resident)
+        self.stale = set()  # Columns with changed blocks since the last update
+    
+    def clear(self):
+        """Forget all light"""
+        self.chunks.clear()
+        self.stale.clear()
+    
+    def chunk(self, index):
+        """Get the light of a chunk, lighting it if it isn't resident"""
+        return self.chunks[index]
+    
+    def region(self, x_start, x_end, y_start, y_end):
+        """Light levels of a rectangle of blocks, indexed [x, y] like the blocks"""
+        return stitch_columns(self.chunk, x_start, x_end, slice(y_start, y_end))
+    
+    def invalidate(self, x):
+        """Note that a block in column x changed, if any light it reaches is resident"""
+        if any(index in self.chunks for index in range((x - MAX_LIGHT) // CHUNK_WIDTH,
+                                                          (x + MAX_LIGHT) // CHUNK_WIDTH + 1)):
+            self.stale.add(x)
+    
+    def update(self):
+        """Relight around the stale columns, returning the (start, end) column ranges relit"""
+        spans = []
+        for x in sorted(self.stale):
+            if spans and x - MAX_LIGHT <= spans[-1][1]:
+                spans[-1][1] = x + MAX_LIGHT + 1
+            else:
+                spans.append([x - MAX_LIGHT, x + MAX_LIGHT + 1])
+        self.stale.clear()
+        
+        for x_start, x_end in spans:
+            # Chunks that aren't resident are lit from the current blocks when next read
+            resident = [index for index in range(x_start // CHUNK_WIDTH, (x_end - 1) // CHUNK_WIDTH + 1)
+                        if index in self.chunks]
+            if not resident:
+                continue
+            light = light_columns(x_start, x_end)
+            for index in resident:
+                offset = index * CHUNK_WIDTH
+                start, end = max(x_start, offset), min(x_end, offset + CHUNK_WIDTH)
+                self.chunks[index][start - offset:end - offset] = light[start - x_start:end - x_start]
+        return spans
+
+light_map = LightMap()
+
+class Pathfinder:
+    """A* search for walking routes between standing positions, with a cache of the paths found"""
+    def __init__(self, cache_size=PATH_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.versions = {}  # Region index -> number of edits to it
+        self.cache = OrderedDict()  # (start, goal, height) -> (path, {region: version} when it was found)
+    
+    def clear(self):
+        """Forget every path and region version"""
+        self.versions.clear()
+        self.cache.clear()
+    
+    def invalidate(self, x):
+        """Note that a block in column x turned solid or open"""
+        region = x // PATH_REGION_WIDTH
+        self.versions[region] = self.versions.get(region, 0) + 1
+    
+    def find_path(self, start, goal, height=1):
+        """Find the shortest walk from start to goal as a list of positions, or None if there isn't one"""
+        key = (start, goal, height)
+        cached = self.cache.get(key)
+        if cached is not None and all(self.versions.get(region, 0) == version
+                                      for region, version in cached[1].items()):
+            self.cache.move_to_end(key)
+            return cached[0]
+        
+        path, x_start, x_end = self.search(start, goal, height)
+        # A path only depends on the columns it crosses, but not finding one depends on every column searched
+        columns = range(x_start, x_end) if path is None else [x for x, _ in path]
+        regions = {x // PATH_REGION_WIDTH for x in columns}
+        self.cache[key] = (path, {region: self.versions.get(region, 0) for region in regions})
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return path
+    
+    def search(self, start, goal, height):
+        """Run A* over the columns around start and goal, returning the path and the columns searched.
+        
+        Positions are flat indices into the searched columns (x * HEIGHT + y) and the
+        blocks are turned into flat lists of which positions the walker fits in and
+        which it can stand at, so the search loop doesn't touch NumPy.
+        """
+        x_start = min(start[0], goal[0]) - PATH_MARGIN
+        x_end = max(start[0], goal[0]) + PATH_MARGIN + 1
+        free = ~SOLID[read_columns(x_start, x_end)]
+        # The walker fits where its whole body is free (above the world counts as free)
+        fits = free.copy()
+        for body in range(1, height):
+            fits[:, body:] &= free[:, :-body]
+        # and stands where it fits on top of something solid (below the world counts as solid)
+        standing = fits.copy()
+        standing[:, :-1] &= ~free[:, 1:]
+        fits, standing = fits.ravel().tolist(), standing.ravel().tolist()
+        width = x_end - x_start
+        
+        def landing(index):
+            # Where a walker at index ends up after falling, or None if it doesn't fit there
+            if not fits[index]:
+                return None
+            while not standing[index]:
+                index += 1
+            return index
+        
+        source = landing((start[0] - x_start) * HEIGHT + start[1]) if 0 <= start[1] < HEIGHT else None
+        target = landing((goal[0] - x_start) * HEIGHT + goal[1]) if 0 <= goal[1] < HEIGHT else None
+        if source is None or target is None:
+            return None, x_start, x_end
+        target_x, target_y = divmod(target, HEIGHT)
+        
+        costs = {source: 0}
+        came_from = {source: None}
+        frontier = [(0, 0, source)]
+        expanded = 0
+        while frontier and expanded < PATH_MAX_NODES:
+            _, cost, index = heapq.heappop(frontier)
+            if index == target:
+                path = []
+                while index is not None:
+                    path.append((x_start + index // HEIGHT, index % HEIGHT))
+                    index = came_from[index]
+                return path[::-1], x_start, x_end
+            if cost > costs[index]:
+                continue  # A cheaper way here was found after this entry was queued
+            expanded += 1
+            
+            x, y = divmod(index, HEIGHT)
+            for dx in (-1, 1):
+                if not 0 <= x + dx < width:
+                    continue
+                ahead = index + dx * HEIGHT
+                if standing[ahead]:
+                    step, step_cost = ahead, 1  # Walk
+                elif fits[ahead]:
+                    step = landing(ahead)  # Walk off the edge and fall
+                    step_cost = 1 + step - ahead
+                elif y > 0 and standing[ahead - 1] and fits[index - 1]:
+                    step, step_cost = ahead - 1, 1  # Step up a block
+                else:
+                    continue
+                
+                step_total = cost + step_cost
+                if step_total < costs.get(step, step_total + 1):
+                    costs[step] = step_total
+                    came_from[step] = index
+                    step_x, step_y = divmod(step, HEIGHT)
+                    # Every move changes x by one and costs at least the rows it changes
+                    estimate = max(abs(target_x - step_x), abs(target_y - step_y))
+                    heapq.heappush(frontier, (step_total + estimate, step_total, step))
+        return None, x_start, x_end
+
+pathfinder = Pathfinder()
+
+def dominant_blocks(children):
+    """The most common block of each set of four, given as an array of shape (4, ...).
+    
+    Ties go to a block that isn't air, so thin layers like the grass stay visible.
+    """
+    counts = (children[:, None] == children[None, :]).sum(axis=1)
+    choice = (counts * 2 + (children != AIR)).argmax(axis=0)
+    return np.take_along_axis(children, choice[None], axis=0)[0]
+
+def downsample(area):
+    """Halve a block array in both directions, keeping the dominant block of each 2x2 square"""
+    width, height = area.shape
+    squares = area.reshape(width // 2, 2, height // 2, 2).transpose(1, 3, 0, 2)
+    return dominant_blocks(squares.reshape(4, width // 2, height // 2))
+
+class MipMap:
+    """Downsampled copies of the blocks for the overview map, each half the size of the last.
+    
+    Level k has a cell for every 2^k x 2^k square of blocks, holding the dominant block
+    of the four cells under it in the level below. The levels are kept a chunk of
+    columns at a time and built when first read. Changed blocks are passed up the levels
+    in one vectorized batch per frame, recomputing only the cells above them.
+    """
+    def __init__(self, max_resident=MAX_RESIDENT_CHUNKS):
+        self.chunks = ChunkCache(self.build, max_resident=max_resident)  # Chunk index -> [level 1, ..., level MIP_LEVELS]
+        self.stale = set()  # Positions of changed blocks not yet passed up the levels
+    
+    def clear(self):
+        """Forget all levels"""
+        self.chunks.clear()
+        self.stale.clear()
+    
+    def chunk(self, index):
+        """Get the levels of a chunk, building them if it isn't resident"""
+        return self.chunks[index]
+    
+    def build(self, index):
+        # Downsample the chunk's blocks level by level
+        x_start = index * CHUNK_WIDTH
+        area = np.zeros((CHUNK_WIDTH, MIP_HEIGHT), dtype=np.uint8)
+        area[:, :HEIGHT] = read_columns(x_start, x_start + CHUNK_WIDTH)
+        if not INFINITE_WORLD:
+            area[:max(-x_start, 0)] = AIR  # Show beyond the world's edges as empty
+            area[max(WIDTH - x_start, 0):] = AIR
+        levels = []
+        for _ in range(MIP_LEVELS):
+            area = downsample(area)
+            levels.append(area)
+        return levels
+    
+    def take(self, level, xs, ys):
+        """Read the cells of a level at arrays of positions"""
+        if level == 0:
+            return get_blocks(xs, ys, outside=AIR)
+        return gather_cells(lambda index: self.chunk(index)[level - 1], xs, ys, CHUNK_WIDTH >> level)
+    
+    def region(self, level, x_start, x_end, y_start, y_end):
+        """Cells of a rectangle of a level, indexed [x, y] like the blocks"""
+        cells = np.zeros((x_end - x_start, y_end - y_start), dtype=np.uint8)
+        rows = slice(max(y_start, 0), min(y_end, MIP_HEIGHT >> level))
+        if rows.start < rows.stop:
+            cells[:, rows.start - y_start:rows.stop - y_start] = stitch_columns(
+                lambda index: self.chunk(index)[level - 1], x_start, x_end, rows, CHUNK_WIDTH >> level)
+        return cells
+    
+    def invalidate(self, x, y):
+        """Note that the block at (x, y) changed, if its chunk is resident"""
+        if x // CHUNK_WIDTH in self.chunks:
+            self.stale.add((x, y))
+    
+    def update(self):
+        """Pass the changed blocks up through the levels of the resident chunks"""
+        cells = {(x >> 1, y >> 1) for x, y in self.stale if x // CHUNK_WIDTH in self.chunks}
+        self.stale.clear()
+        for level in range(1, MIP_LEVELS + 1):
+            if not cells:
+                break
+            xs, ys = np.array(sorted(cells)).T
+            children = np.stack([self.take(level - 1, xs * 2 + dx, ys * 2 + dy)
+                                 for dx, dy in ((0, 0), (0, 1), (1, 0), (1, 1))])  # Same order as downsample
+            dominant = dominant_blocks(children)
+            width = CHUNK_WIDTH >> level
+            indices = xs // width
+            for index in np.unique(indices).tolist():
+                in_chunk = indices == index
+                self.chunk(index)[level - 1][xs[in_chunk] - index * width, ys[in_chunk]] = dominant[in_chunk]
+            cells = {(x >> 1, y >> 1) for x, y in cells}
+
+mip_map = MipMap()
+
+class EditJournal:
+    """Append-only history of every block change as (x, y, old, new, tick, player, held) entries.
+    
+    Entries are kept in a structured array that doubles when it fills up, after
+    compacting away edits older than the last UNDO_LIMIT player edits. Undo rewinds
+    the world to just before the last player edit, water flow and falling sand
+    included, and redo replays it. Held is how many blocks a player edit put in
+    the hotbar (-1 for a block placed), which undo and redo give back or take
+    again, so they refuse when the block has been spent or there's no room for it.
+    Entries after position have been undone and are dropped as soon as anything
+    else changes. The journal also keeps the blocks changed since the world was
+    last written to saved_path, for autosave.
+    """
+    def __init__(self):
+        self.entries = np.zeros(JOURNAL_CAPACITY, dtype=JOURNAL_ENTRY)
+        self.clear()
+    
+    def clear(self):
+        self.length = 0  # Entries in use
+        self.position = 0  # Entries applied to the world, the rest can be redone
+        self.tick = 0  # Game tick recorded with each edit
+        self.replaying = False  # Undo and redo change blocks without recording them
+        self.unsaved = set()  # Positions changed since the world was saved
+        self.saved_path = None  # Save file the world was last written to or loaded from
+        self.deltas_saved = 0  # Changes appended to that file since it was written in full
+    
+    def record(self, x, y, old, new, player=False, held=0):
+        """Append a change made through set_block"""
+        if self.replaying or old == new:
+            return
+        self.unsaved.add((x, y))
+        self.length = self.position
+        if self.length == len(self.entries):
+            self.compact()
+            if self.length > len(self.entries) // 2:
+                self.entries = np.concatenate([self.entries, np.zeros_like(self.entries)])
+        self.entries[self.length] = (x, y, old, new, self.tick, player, held)
+        self.length += 1
+        self.position = self.length
+    
+    def compact(self):
+        """Drop the entries from before the oldest player edit that can still be undone"""
+        player_edits = np.flatnonzero(self.entries["player"][:self.position])[-UNDO_LIMIT:]
+        start = int(player_edits[0]) if len(player_edits) else self.position
+        self.entries[:self.length - start] = self.entries[start:self.length]
+        self.length -= start
+        self.position -= start
+    
+    def replay(self, entries, field):
+        # Write the old or new block of each entry without recording it
+        self.replaying = True
+        try:
+            for x, y, block in zip(entries["x"].tolist(), entries["y"].tolist(), entries[field].tolist()):
+                set_block(x, y, block)
+                self.unsaved.add((x, y))
+        finally:
+            self.replaying = False
+    
+    def exchange(self, inventory, entry, direction):
+        # Give back (direction -1) or take again (1) the blocks a player edit put in the hotbar
+        held = int(entry["held"]) * direction
+        block_type = int(entry["old"] if entry["held"] > 0 else entry["new"])
+        if held > 0 and inventory.space(block_type) < held or held < 0 and inventory.count(block_type) < -held:
+            return False
+        if held > 0:
+            inventory.add(block_type, held)
+        elif held < 0:
+            inventory.remove(block_type, -held)
+        return True
+    
+    def undo(self, inventory):
+        """Rewind the world to just before the last player edit, returning whether there was one.
+        
+        The hotbar gets back what the edit took from it and loses what it gave.
+        """
+        player_edits = np.flatnonzero(self.entries["player"][:self.position])
+        if not len(player_edits):
+            return False
+        start = int(player_edits[-1])
+        if not self.exchange(inventory, self.entries[start], -1):
+            return False
+        self.replay(self.entries[start:self.position][::-1], "old")
+        self.position = start
+        return True
+    
+    def redo(self, inventory):
+        """Replay the next undone player edit and what followed it, returning whether there was one"""
+        if self.position == self.length or not self.exchange(inventory, self.entries[self.position], 1):
+            return False
+        later_edits = np.flatnonzero(self.entries["player"][self.position + 1:self.length])
+        end = self.position + 1 + int(later_edits[0]) if len(later_edits) else self.length
+        self.replay(self.entries[self.position:end], "new")
+        self.position = end
+        return True
+    
+    def take_unsaved(self):
+        """(x, y) arrays of the positions changed since the last save, which are now saved"""
+        positions = np.array(sorted(self.unsaved), dtype=np.int64).reshape(-1, 2)
+        self.unsaved = set()
+        return positions[:, 0], positions[:, 1]
+
+journal = EditJournal()
+
+def forget_world():
+    """Clear everything kept about the blocks of the current world"""
+    light_map.clear()
+    mip_map.clear()
+    pathfinder.clear()
+    journal.clear()
+    dirty_blocks.clear()
+    active_water.clear()
+    awake_blocks.clear()
+
+def create_world():
+    """Set up the blocks: a generated WIDTH x HEIGHT array, or chunks generated on demand"""
+    global blocks
+    forget_world()
+    if INFINITE_WORLD:
+        blocks = ChunkedWorld(WORLD_SEED)
+    else:
+        generate_terrain()
+
+def set_block(x, y, block, player=False, held=0):
+    """Change a block in the world, keeping the surface index up to date and journaling the change"""
+    journal.record(x, y, int(blocks[x, y]), int(block), player, held)
+    if SOLID[blocks[x, y]] != SOLID[block]:
+        pathfinder.invalidate(x)
+    blocks[x, y] = block
+    if not INFINITE_WORLD:  # Chunked worlds keep their own surface index
+        update_surface(surface, blocks[x], x, y, block)
+    dirty_blocks.append((x, y))
+    light_map.invalidate(x)
+    mip_map.invalidate(x, y)
+    wake_water(x, y)
+    wake_falling_blocks(x, y)
+
+def surface_top(x):
+    """Row of the top solid block in column x (HEIGHT if the column is empty)"""
+    if INFINITE_WORLD:
+        return blocks.surface_top(x)
+    return int(surface[x])
+
+def in_world(x, y):
+    """Check if a block position exists (infinite worlds have no left or right edge)"""
+    return 0 <= y < HEIGHT and (INFINITE_WORLD or 0 <= x < WIDTH)
+
+def get_blocks(xs, ys, outside=STONE):
+    """Read the blocks at arrays of positions at once, positions outside the world read as outside"""
+    inside = (ys >= 0) & (ys < HEIGHT)
+    if not INFINITE_WORLD:
+        inside &= (xs >= 0) & (xs < WIDTH)
+    result = np.full(xs.shape, outside, dtype=np.uint8)
+    if INFINITE_WORLD:
+        result[inside] = blocks.take(xs[inside], ys[inside])
+    else:
+        result[inside] = blocks[xs[inside], ys[inside]]
+    return result
+
+def is_solid(xs, ys, outside=AIR):
+    """Check arrays of positions for blocks the player collides with, positions outside the world read as outside"""
+    return SOLID[get_blocks(np.asarray(xs), np.asarray(ys), outside)]
+
+def wake_water(x, y):
+    """Have the water simulation look at a changed block and its neighbours"""
+    active_water.update(((x, y), (x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)))
+
+def pick_movers(first_choice, second_choice, target_x, target_y):
+    """Let one cell move into each target, preferring first_choice cells (arrays of indices).
+    
+    Returns the indices that move and the ones that were blocked by another cell.
+    """
+    movers = np.concatenate((first_choice, second_choice))
+    _, first = np.unique(target_x[movers] * HEIGHT + target_y[movers], return_index=True)
+    winners = movers[first]
+    return winners, np.setdiff1d(movers, winners)
+
+def simulate_water():
+    """Let water flow one step, looking only at the active cells.
+    
+    Water falls into air below it. Otherwise it moves one block sideways towards the
+    nearest drop along its row, so lakes level out and then settle. Every move goes
+    through set_block, which wakes the cells around it for the next step; settled
+    water drops out of the active set.
+    """
+    if not active_water:
+        return
+    cells = np.array(list(active_water))
+    active_water.clear()
+    xs, ys = cells[:, 0], cells[:, 1]
+    is_water = get_blocks(xs, ys) == WATER
+    xs, ys = xs[is_water], ys[is_water]
+    if not xs.size:
+        return
+    
+    falls = get_blocks(xs, ys + 1) == AIR
+    
+    # Find the nearest drop on each side, through air along the row
+    drop_distance = {}
+    for side in (-1, 1):
+        distance_found = np.full(xs.size, WATER_FLOW_DISTANCE + 1)
+        open_row = ~falls
+        for distance in range(1, WATER_FLOW_DISTANCE + 1):
+            open_row &= get_blocks(xs + side * distance, ys) == AIR
+            drop = open_row & (get_blocks(xs + side * distance, ys + 1) == AIR)
+            distance_found[drop & (distance_found > distance)] = distance
+        drop_distance[side] = distance_found
+    left, right = drop_distance[-1], drop_distance[1]
+    # Head for the closer drop, picking a random side on ties
+    side = np.where((left < right) | ((left == right) & (np.random.random(xs.size) < 0.5)), -1, 1)
+    flows = ~falls & (np.minimum(left, right) <= WATER_FLOW_DISTANCE)
+    
+    target_x, target_y = xs + np.where(flows, side, 0), ys + falls
+    
+    # Only one cell can move into each target, falling water first, the others try again next step
+    winners, blocked = pick_movers(np.flatnonzero(falls), np.flatnonzero(flows), target_x, target_y)
+    active_water.update(zip(xs[blocked].tolist(), ys[blocked].tolist()))
+    
+    for i in winners.tolist():
+        x, y = int(xs[i]), int(ys[i])
+        set_block(x, y, AIR)
+        set_block(int(target_x[i]), int(target_y[i]), WATER)
+        # The emptied block can be the drop or the gap that water further along was looking for
+        active_water.update((x + distance, row) for distance in range(-WATER_FLOW_DISTANCE, WATER_FLOW_DISTANCE + 1)
+                            for row in (y - 1, y))
+
+def wake_falling_blocks(x, y):
+    """Have gravity look at a changed block and the blocks that could be resting on it"""
+    awake_blocks.update(((x, y), (x - 1, y - 1), (x, y - 1), (x + 1, y - 1)))
+
+def simulate_falling_blocks():
+    """Drop unsupported sand (and leaves with FALLING_LEAVES) one step, looking only at awake cells.
+    
+    Sand falls through air and sinks through water, or slides diagonally down off a
+    pile. Blocks that can't move go back to sleep until set_block wakes them again,
+    so resting sand costs nothing however much of it there is.
+    """
+    if not awake_blocks:
+        return
+    cells = np.array(list(awake_blocks))
+    awake_blocks.clear()
+    xs, ys = cells[:, 0], cells[:, 1]
+    kinds = get_blocks(xs, ys)
+    falling = (kinds == SAND) | (FALLING_LEAVES & (kinds == GRASS))
+    xs, ys, kinds = xs[falling], ys[falling], kinds[falling]
+    if not xs.size:
+        return
+    
+    below = get_blocks(xs, ys + 1)
+    falls = (below == AIR) | (below == WATER)
+    # Otherwise slide off a pile into air diagonally below, trying a random side first
+    side = np.where(np.random.random(xs.size) < 0.5, -1, 1)
+    slides = np.zeros(xs.size, dtype=bool)
+    for direction in (side, -side):
+        into = (~falls & ~slides & (get_blocks(xs + direction, ys) == AIR) &
+                (get_blocks(xs + direction, ys + 1) == AIR))
+        side[into] = direction[into]
+        slides |= into
+    target_x, target_y = xs + np.where(slides, side, 0), ys + 1
+    
+    winners, blocked = pick_movers(np.flatnonzero(falls), np.flatnonzero(slides), target_x, target_y)
+    awake_blocks.update(zip(xs[blocked].tolist(), ys[blocked].tolist()))
+    
+    for i in winners.tolist():
+        x, y = int(target_x[i]), int(target_y[i])
+        # Water the block sinks into takes its place
+        set_block(int(xs[i]), int(ys[i]), blocks[x, y])
+        set_block(x, y, int(kinds[i]))
+
+def save_world(path, player, inventory, compressed=SAVE_COMPRESSED):
+    """Write the world, player and inventory to a save file.
+    
+    The file is a magic number, the header length and a JSON header, followed by
+    8-byte aligned data sections. A finite world stores its surface index and its
+    blocks, either raw so load_world can memory-map them or as zlib-compressed chunks
+    of CHUNK_WIDTH columns. An infinite world only stores the blocks the player
+    changed, since its chunks are regenerated from the seed. autosave can then append
+    the blocks changed since as (x, y, block) records after the last section.
+    """
+    global blocks
+    if INFINITE_WORLD:
+        edits = [(index * CHUNK_WIDTH + x, y, block)
+                 for index, chunk_edits in blocks.edits.items() for (x, y), block in chunk_edits.items()]
+        sections = [np.array(edits, dtype=np.int64).reshape(-1, 3).tobytes()]
+    elif compressed:
+        sections = [surface.astype(np.int16).tobytes()] + [
+            zlib.compress(np.ascontiguousarray(blocks[x:x + CHUNK_WIDTH]).tobytes())
+            for x in range(0, WIDTH, CHUNK_WIDTH)
+        ]
+    else:
+        sections = [surface.astype(np.int16).tobytes(), np.ascontiguousarray(blocks).tobytes()]
+    
+    header = json.dumps({
+        "version": SAVE_VERSION,
+        "seed": WORLD_SEED,
+        "infinite": INFINITE_WORLD,
+        "vectorized_caves": VECTORIZED_CAVES,
+        "width": WIDTH,
+        "height": HEIGHT,
+        "compressed": compressed,
+        "player": [player.x, player.y],
+        "inventory": inventory.state(),
+        "sections": [len(section) for section in sections],
+    }).encode()
+    
+    # Write next to the old save and swap it in, so a memory-mapped world stays readable
+    with open(path + ".tmp", "wb") as file:
+        file.write(SAVE_MAGIC + struct.pack("<I", len(header)) + header)
+        offsets = []
+        for section in sections:
+            file.write(b"\0" * (-file.tell() % 8))
+            offsets.append(file.tell())
+            file.write(section)
+    
+    # A world mapped from the old save lets go of it first (Windows can't replace a mapped file),
+    # then maps the blocks just written
+    mapped = isinstance(blocks, np.memmap) and os.path.abspath(blocks.filename) == os.path.abspath(path)
+    if mapped:
+        blocks = np.array(blocks)
+    os.replace(path + ".tmp", path)
+    if mapped and not INFINITE_WORLD and not compressed:
+        blocks = np.memmap(path, dtype=np.uint8, mode="c", offset=offsets[1], shape=(WIDTH, HEIGHT))
+    journal.take_unsaved()
+    journal.saved_path = path
+    journal.deltas_saved = 0
+
+def load_world(path):
+    """Open a save file written by save_world and return its header.
+    
+    Raw blocks are memory-mapped copy-on-write rather than read, so opening a huge
+    world is instant and only the pages that get drawn or changed are loaded. Blocks
+    appended by autosave are applied on top.
+    """
+    global blocks, surface, WIDTH, INFINITE_WORLD, WORLD_SEED, VECTORIZED_CAVES
+    forget_world()
+    with open(path, "rb") as file:
+        if file.read(4) != SAVE_MAGIC:
+            raise ValueError(f"{path} is not a mincraft save file")
+        header_length, = struct.unpack("<I", file.read(4))
+        header = json.loads(file.read(header_length))
+        if header["version"] != SAVE_VERSION or header["height"] != HEIGHT:
+            raise ValueError(f"{path} was saved by an incompatible version of the game")
+        
+        offsets = []
+        offset = 8 + header_length
+        for length in header["sections"]:
+            offset += -offset % 8
+            offsets.append(offset)
+            offset += length
+        
+        def read_section(i):
+            file.seek(offsets[i])
+            return file.read(header["sections"][i])
+        
+        # Whole (x, y, block) records appended by autosave (the last may be cut short by a crash)
+        file.seek(offset)
+        appended = file.read()
+        deltas = np.frombuffer(appended[:len(appended) - len(appended) % 24], dtype=np.int64).reshape(-1, 3)
+        journal.saved_path = path
+        journal.deltas_saved = len(deltas)
+        
+        WORLD_SEED = header["seed"]
+        INFINITE_WORLD = header["infinite"]
+        VECTORIZED_CAVES = header.get("vectorized_caves", False)  # Chunks regenerate with the caves they had
+        if INFINITE_WORLD:
+            blocks = ChunkedWorld(WORLD_SEED)
+            edits = np.frombuffer(read_section(0), dtype=np.int64).reshape(-1, 3)
+            for x, y, block in np.concatenate([edits, deltas]).tolist():
+                index, local_x = divmod(x, CHUNK_WIDTH)
+                blocks.edits.setdefault(index, {})[(local_x, y)] = block
+            return header
+        
+        WIDTH = header["width"]
+        surface = np.frombuffer(read_section(0), dtype=np.int16).astype(int)
+        if header["compressed"]:
+            blocks = np.concatenate([
+                np.frombuffer(zlib.decompress(read_section(i)), dtype=np.uint8).reshape(-1, HEIGHT)
+                for i in range(1, len(offsets))
+            ])
+        else:
+            blocks = np.memmap(path, dtype=np.uint8, mode="c", offset=offsets[1], shape=(WIDTH, HEIGHT))
+        for x, y, block in deltas.tolist():
+            blocks[x, y] = block
+            update_surface(surface, blocks[x], x, y, block)
+    return header
+
+def autosave(path, player, inventory):
+    """Bring a save file up to date with the world.
+    
+    If the world was last saved to or loaded from path, only the blocks changed since
+    are appended to it, so the player and inventory stay as they were last saved in
+    full. Otherwise, or once AUTOSAVE_MAX_DELTAS blocks have been appended, the whole
+    file is rewritten with save_world.
+    """
+    if (journal.saved_path != path or not os.path.exists(path) or
+            journal.deltas_saved + len(journal.unsaved) > AUTOSAVE_MAX_DELTAS):
+        save_world(path, player, inventory)
+        return
+    xs, ys = journal.take_unsaved()
+    if len(xs):
+        with open(path, "ab") as file:
+            file.write(np.stack([xs, ys, get_blocks(xs, ys)], axis=1).astype(np.int64).tobytes())
+        journal.deltas_saved += len(xs)
+
+class PyxelInput:
+    """Reads the keyboard and mouse through pyxel"""
+    def btn(self, key):
+        return pyxel.btn(key)
+    
+    def btnp(self, key):
+        return pyxel.btnp(key)
+    
+    @property
+    def mouse_x(self):
+        return pyxel.mouse_x
+    
+    @property
+    def mouse_y(self):
+        return pyxel.mouse_y
+
+class ScriptedInput:
+    """Replays input from a script instead of reading the keyboard and mouse.
+    
+    The script is a list of (ticks, keys, mouse_x, mouse_y) steps, each holding its keys
+    (and mouse buttons) down with the mouse at one screen position for a number of
+    ticks. A key counts as pressed on the tick it goes down. The script loops forever.
+    """
+    def __init__(self, script):
+        self.script = script
+        self.step = -1
+        self.ticks_left = 0
+        self.held = set()
+        self.previous = set()
+        self.mouse_x = 0
+        self.mouse_y = 0
+    
+    def advance(self):
+        """Move the script on by one tick"""
+        self.previous = self.held
+        if self.ticks_left == 0:
+            self.step = (self.step + 1) % len(self.script)
+            self.ticks_left, keys, self.mouse_x, self.mouse_y = self.script[self.step]
+            self.held = set(keys)
+        self.ticks_left -= 1
+    
+    def btn(self, key):
+        return key in self.held
+    
+    def btnp(self, key):
+        return key in self.held and key not in self.previous
+
+controls = PyxelInput()  # Where the game reads its input from
+
+class SpatialHash:
+    """Uniform grid of cells over a set of points, for finding the points near a position.
+    
+    Built from arrays of positions by sorting the point indices by cell, so looking up a
+    cell is a binary search for its run of indices rather than a scan of every point.
+    """
+    def __init__(self, cell_size=MOB_HASH_CELL):
+        self.cell_size = cell_size
+        self.xs = np.zeros(0)
+        self.ys = np.zeros(0)
+        self.order = np.zeros(0, dtype=np.int64)  # Point indices sorted by cell
+        self.sorted_keys = np.zeros(0, dtype=np.int64)  # Cell key of each point in that order
+        self.blocks = np.zeros(0, dtype=np.int64)  # Sorted keys of the blocks the points are on
+    
+    def build(self, xs, ys):
+        """Index a new set of point positions"""
+        self.xs, self.ys = xs.copy(), ys.copy()
+        keys = (np.floor(xs / self.cell_size).astype(np.int64) * HASH_KEY_STRIDE +
+                np.floor(ys / self.cell_size).astype(np.int64))
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+        self.blocks = sorted_unique(np.floor(xs).astype(np.int64) * HASH_KEY_STRIDE +
+                                    np.floor(ys).astype(np.int64))
+    
+    def query(self, x_start, y_start, x_end, y_end):
+        """Indices of the points with x_start <= x < x_end and y_start <= y < y_end"""
+        size = self.cell_size
+        cell_xs, cell_ys = np.meshgrid(np.arange(x_start // size, x_end // size + 1, dtype=np.int64),
+                                       np.arange(y_start // size, y_end // size + 1, dtype=np.int64))
+        keys = (cell_xs * HASH_KEY_STRIDE + cell_ys).ravel()
+        starts = np.searchsorted(self.sorted_keys, keys, side="left")
+        ends = np.searchsorted(self.sorted_keys, keys, side="right")
+        found = np.concatenate([self.order[start:end] for start, end in zip(starts, ends)])
+        xs, ys = self.xs[found], self.ys[found]
+        return found[(xs >= x_start) & (xs < x_end) & (ys >= y_start) & (ys < y_end)]
+    
+    def occupied(self, columns, rows):
+        """Whether there is a point on each of the blocks (columns, rows)"""
+        keys = columns * HASH_KEY_STRIDE + rows
+        if not len(self.blocks):
+            return np.zeros(keys.shape, dtype=bool)
+        found = np.minimum(np.searchsorted(self.blocks, keys), len(self.blocks) - 1)
+        return self.blocks[found] == keys
+
+class Mobs:
+    """Every mob in the world, stored as parallel arrays rather than an object per mob.
+    
+    Positions, velocities and kinds are NumPy arrays, so walking, gravity and collision
+    with the blocks are worked out for all the mobs together in a fixed number of array
+    operations each tick. Mobs are one block tall and move like the player: they step
+    up single blocks, are slowed by water and can't walk into each other. Zombies
+    chasing the player follow a path from the pathfinder; each keeps the start and goal
+    of its route in routes, so the cached path is reused until it needs searching again.
+    """
+    FIELDS = ("x", "y", "vel_x", "vel_y", "kind")
+    
+    def __init__(self, capacity=MAX_MOBS):
+        self.count = 0
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.vel_x = np.zeros(capacity)
+        self.vel_y = np.zeros(capacity)
+        self.kind = np.zeros(capacity, dtype=np.uint8)
+        self.routes = []  # (start, goal) of each mob's path, or None
+        self.grid = SpatialHash()
+        self.ticks = 0
+    
+    def add(self, x, y, kind):
+        """Add a mob, growing the arrays if they are full"""
+        if self.count == len(self.x):
+            for field in self.FIELDS:
+                array = getattr(self, field)
+                setattr(self, field, np.concatenate([array, np.zeros_like(array)]))
+        index = self.count
+        self.x[index], self.y[index], self.kind[index] = x, y, kind
+        self.vel_x[index] = self.vel_y[index] = 0
+        self.routes.append(None)
+        self.count += 1
+        self.grid.build(self.x[:self.count], self.y[:self.count])
+    
+    def remove(self, removed):
+        """Remove the mobs where the boolean array removed is set"""
+        kept = ~removed
+        remaining = int(kept.sum())
+        for field in self.FIELDS:
+            array = getattr(self, field)
+            array[:remaining] = array[:self.count][kept]
+        self.routes = [route for route, keep in zip(self.routes, kept.tolist()) if keep]
+        self.count = remaining
+        self.grid.build(self.x[:self.count], self.y[:self.count])
+    
+    def hit(self, x, y):
+        """Kill the mobs on block (x, y), returning whether there were any"""
+        found = self.grid.query(x, y, x + 1, y + 1)
+        if len(found):
+            removed = np.zeros(self.count, dtype=bool)
+            removed[found] = True
+            self.remove(removed)
+        return len(found) > 0
+    
+    def spawn_near(self, player):
+        """Try to spawn a mob on the surface just out of the player's view"""
+        x = int(player.x) + random.choice((-1, 1)) * MOB_SPAWN_DISTANCE
+        if in_world(x, 0):
+            y = surface_top(x) - 1
+            if y >= 0:
+                self.add(x, y, random.choice((PIG, ZOMBIE)))
+    
+    def update(self, player):
+        """Spawn and despawn mobs around the player and move them all one tick"""
+        self.ticks += 1
+        if self.ticks % MOB_SPAWN_INTERVAL == 0 and self.count < MAX_MOBS:
+            self.spawn_near(player)
+        if self.count:
+            self.remove(np.abs(self.x[:self.count] - player.x) > MOB_DESPAWN_DISTANCE)
+        if self.count:
+            self.move(player)
+            self.grid.build(self.x[:self.count], self.y[:self.count])
+    
+    def move(self, player):
+        """Walk, fall and collide every mob with the blocks in one vectorized step"""
+        n = self.count
+        x, y, vel_x, vel_y, kind = self.x[:n], self.y[:n], self.vel_x[:n], self.vel_y[:n], self.kind[:n]
+        column, row = np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+        
+        # Climb out of blocks placed on or fallen onto a mob
+        buried = is_solid(column, row, outside=STONE)
+        y[buried] -= 1
+        row[buried] -= 1
+        if buried.any():
+            self.grid.build(x, y)
+        
+        # Zombies walk toward a nearby player, everything else wanders
+        speed = MOB_SPEEDS[kind]
+        chasing = ((kind == ZOMBIE) & (np.abs(player.x - x) < ZOMBIE_CHASE_RANGE) &
+                   (np.abs(player.y - y) < ZOMBIE_CHASE_RANGE))
+        turning = ~chasing & (np.random.random(n) < MOB_TURN_CHANCE)
+        vel_x[turning] = np.random.choice((-1, 0, 1), int(turning.sum())) * speed[turning]
+        goal = (int(player.x), int(player.y + PLAYER_HEIGHT - 1))
+        for index in np.flatnonzero(chasing).tolist():
+            vel_x[index] = self.chase_direction(index, (int(column[index]), int(row[index])), goal) * speed[index]
+        in_water = LIQUID[get_blocks(column, row)]
+        
+        # Walk, stepping up single blocks and stopping at walls and other mobs
+        new_x = x + np.where(in_water, vel_x * WATER_SLOWDOWN, vel_x)
+        if not INFINITE_WORLD:
+            new_x = np.clip(new_x, 0, WIDTH - 1)
+        target = np.floor(new_x).astype(np.int64)
+        wall = is_solid(target, row, outside=STONE)
+        step = (wall & ~is_solid(target, row - 1, outside=STONE) &
+                ~is_solid(column, row - 1, outside=STONE))
+        target_row = row - step
+        moves = (~wall | step) & (target == column)
+        entering = np.flatnonzero((~wall | step) & (target != column) &
+                                  ~self.grid.occupied(target, target_row))
+        winners, _ = pick_movers(entering, entering[:0], target, target_row)  # One mob into each block
+        moves[winners] = True
+        x[moves] = new_x[moves]
+        y[moves & step] -= 1
+        vel_x[wall & ~step] *= -1  # Wanderers turn back at walls
+        
+        # Fall, landing on the first block below that the fall reaches
+        vel_y += GRAVITY * np.where(in_water, WATER_SLOWDOWN, 1.0)
+        np.minimum(vel_y, np.where(in_water, 1.5, 3), out=vel_y)
+        column, row = np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+        last_row = np.floor(y + vel_y).astype(np.int64) + 1
+        y += vel_y
+        landed = np.zeros(n, dtype=bool)
+        for drop in range(1, 5):  # Falls are at most 3 blocks a tick
+            below = row + drop
+            lands = ~landed & (below <= last_row) & is_solid(column, below, outside=STONE)
+            y[lands] = below[lands] - 1
+            landed |= lands
+        vel_y[landed] = 0
+    
+    def chase_direction(self, index, position, goal):
+        """Direction a chasing mob should walk in to follow its path to goal"""
+        route = self.routes[index]
+        if route is None or (route[1] != goal and (self.ticks + index) % ZOMBIE_REPATH_INTERVAL == 0):
+            route = self.routes[index] = (position, goal)
+        path = pathfinder.find_path(*route)
+        if path is not None and position not in path:
+            # Pushed or fallen off the path, so find one from here
+            route = self.routes[index] = (position, goal)
+            path = pathfinder.find_path(*route)
+        if path is None:
+            return np.sign(goal[0] - position[0])
+        
+        # In mid-air the path starts from where the mob will land
+        step = path.index(position) + 1 if position in path else 1
+        return np.sign(path[step][0] - position[0]) if step < len(path) else 0
+    
+    def draw(self, camera):
+        n = self.count
+        screen_x = np.floor(self.x[:n]).astype(np.int64) - camera.x
+        screen_y = np.floor(self.y[:n]).astype(np.int64) - camera.y
+        visible = (screen_x >= 0) & (screen_x < DISPLAY_WIDTH) & (screen_y >= 0) & (screen_y < DISPLAY_HEIGHT)
+        for mob_x, mob_y, color in zip(screen_x[visible].tolist(), screen_y[visible].tolist(),
+                                       MOB_COLORS[self.kind[:n][visible]].tolist()):
+            pyxel.pset(mob_x, mob_y, color)
 
 class Camera:
     def __init__(self, target=None):
@@ -402,7 +1741,8 @@ class Camera:
             self.y = int(self.target.y - self.height // 2)
             
             # Keep camera within world bounds
-            self.x = max(0, min(WIDTH - self.width, self.x))
+            if not INFINITE_WORLD:
+                self.x = max(0, min(WIDTH - self.width, self.x))
             self.y = max(0, min(HEIGHT - self.height, self.y))
     
     def screen_to_world(self, screen_x, screen_y):
@@ -421,13 +1761,13 @@ class Player:
     
     def update(self):
         # Handle left/right movement
-        if pyxel.btn(pyxel.KEY_LEFT):
+        if controls.btn(pyxel.KEY_LEFT):
             self.move(-PLAYER_SPEED)
-        if pyxel.btn(pyxel.KEY_RIGHT):
+        if controls.btn(pyxel.KEY_RIGHT):
             self.move(PLAYER_SPEED)
         
         # Handle jumping
-        if pyxel.btnp(pyxel.KEY_SPACE) and self.on_ground:
+        if controls.btnp(pyxel.KEY_SPACE) and self.on_ground:
             self.vel_y = -JUMP_FORCE
             self.on_ground = False
         
@@ -448,9 +1788,8 @@ class Player:
         # Check if in water
         feet_y = int(self.y + PLAYER_HEIGHT - 1)
         head_y = int(self.y)
-        self.in_water = (0 <= int(self.x) < WIDTH and 
-                         ((0 <= feet_y < HEIGHT and blocks[int(self.x), feet_y] == WATER) or
-                          (0 <= head_y < HEIGHT and blocks[int(self.x), head_y] == WATER)))
+        self.in_water = ((in_world(int(self.x), feet_y) and LIQUID[blocks[int(self.x), feet_y]]) or
+                         (in_world(int(self.x), head_y) and LIQUID[blocks[int(self.x), head_y]]))
     
     def move(self, dx):
         # Apply water slowdown if applicable
@@ -464,24 +1803,21 @@ class Player:
         feet_y = int(self.y + PLAYER_HEIGHT - 1)
         body_y = int(self.y + PLAYER_HEIGHT // 2)
         
-        # Ensure we don't go off the screen edges
-        if new_x < 0:
-            new_x = 0
-        elif new_x >= WIDTH:
-            new_x = WIDTH - 1
+        # Ensure we don't go off the world edges
+        if not INFINITE_WORLD:
+            new_x = max(0, min(WIDTH - 1, new_x))
         
-        # Check collision with terrain horizontally
-        if (0 <= feet_y < HEIGHT and 
-            blocks[int(new_x), feet_y] not in [AIR, WATER]):
+        # Check collision with terrain horizontally, looking up the feet, step and body blocks together
+        column = int(new_x)
+        feet_solid, step_solid, body_solid = is_solid((column, column, column), (feet_y, feet_y - 1, body_y))
+        if feet_solid:
             # There's a block at foot level, check if we can step up
-            if (feet_y - 1 >= 0 and 
-                blocks[int(new_x), feet_y - 1] in [AIR, WATER]):
+            if feet_y - 1 >= 0 and not step_solid:
                 # We can step up one block
                 self.y -= 1
                 self.x = new_x
             # Otherwise, we can't move
-        elif (0 <= body_y < HEIGHT and 
-              blocks[int(new_x), body_y] not in [AIR, WATER]):
+        elif body_solid:
             # There's a block at body level, we can't move
             pass
         else:
@@ -500,10 +1836,10 @@ class Player:
             return
         
         # Check if standing on a solid block
-        if 0 <= int(self.x) < WIDTH and feet_y < HEIGHT:
+        if in_world(int(self.x), feet_y):
             block_below = blocks[int(self.x), feet_y]
             
-            if block_below not in [AIR, WATER]:
+            if SOLID[block_below]:
                 # Collision with terrain
                 self.y = feet_y - PLAYER_HEIGHT  # Position precisely on top of the block
                 self.vel_y = 0
@@ -513,10 +1849,10 @@ class Player:
         
         # Check collision above (head)
         head_y = int(self.y - 1)
-        if head_y >= 0 and head_y < HEIGHT and int(self.x) < WIDTH:
+        if in_world(int(self.x), head_y):
             block_above = blocks[int(self.x), head_y]
             
-            if block_above not in [AIR, WATER]:
+            if SOLID[block_above]:
                 # Hit head on a block
                 self.y = head_y + 1
                 self.vel_y = 0
@@ -541,120 +1877,382 @@ class Player:
         distance = max(dx, dy)  # Use maximum distance (Chebyshev distance)
         return distance <= MINING_RANGE
 
-class Game:
+class ViewportRenderer:
+    """Draws the blocks in the camera view from a cached frame copied into an image bank.
+    
+    Block types are pyxel colours and each block is one pixel, so the visible slice of
+    the blocks array is already the image to show. Air and bedrock are both colour 0,
+    the same as the cleared screen. With LIGHTING each block is drawn in its colour from
+    LIGHT_PALETTE for its light level instead. The frame is kept between draws: only
+    blocks listed in dirty_blocks (or with LIGHTING, the columns relit around them) and
+    the rows and columns the camera scrolls into view are repainted.
+    """
+    def __init__(self, camera, image_bank=VIEWPORT_IMAGE):
+        self.camera = camera
+        self.image_bank = image_bank
+        self.origin = None  # World position of the cached frame's top left block
+        image = pyxel.images[image_bank]
+        # Paint straight into the image's pixels when pyxel exposes them, otherwise keep
+        # the frame separately and upload the changes to the image
+        if hasattr(image, "data_ptr"):
+            pixels = np.ctypeslib.as_array(image.data_ptr()).reshape(image.height, image.width)
+            self.frame = pixels[:camera.height, :camera.width]
+            self.direct = True
+        else:
+            self.frame = np.zeros((camera.height, camera.width), dtype=np.uint8)
+            self.direct = False
+    
+    def paint(self, x_start, x_end, y_start, y_end):
+        """Repaint a rectangle of the frame (in screen coordinates) from the blocks"""
+        x, y = self.origin
+        colours = blocks[x + x_start:x + x_end, y + y_start:y + y_end]
+        if LIGHTING:
+            colours = LIGHT_PALETTE[light_map.region(x + x_start, x + x_end, y + y_start, y + y_end), colours]
+        self.frame[y_start:y_end, x_start:x_end] = colours.T
+    
+    def refresh(self):
+        """Bring the cached frame up to date.
+        
+        Returns the screen positions that were repainted, or None if the whole frame moved.
+        """
+        camera = self.camera
+        width, height = camera.width, camera.height
+        dirty = dirty_blocks[:]
+        dirty_blocks.clear()
+        relit = light_map.update() if LIGHTING else []
+        
+        if self.origin is None:
+            dx, dy = width, height
+        else:
+            dx, dy = camera.x - self.origin[0], camera.y - self.origin[1]
+        self.origin = (camera.x, camera.y)
+        
+        if abs(dx) >= width or abs(dy) >= height:
+            self.paint(0, width, 0, height)
+            return None
+        
+        if dx or dy:
+            # Scroll the cached frame and paint only what came into view
+            self.frame[:, :] = np.roll(self.frame, (-dy, -dx), axis=(0, 1))
+            if dx > 0:
+                self.paint(width - dx, width, 0, height)
+            elif dx < 0:
+                self.paint(0, -dx, 0, height)
+            if dy > 0:
+                self.paint(0, width, height - dy, height)
+            elif dy < 0:
+                self.paint(0, width, 0, -dy)
+        
+        if LIGHTING:
+            # Repaint the relit columns in view, which include every changed block
+            relit_in_view = False
+            for x_start, x_end in relit:
+                x_start, x_end = max(x_start - camera.x, 0), min(x_end - camera.x, width)
+                if x_start < x_end:
+                    self.paint(x_start, x_end, 0, height)
+                    relit_in_view = True
+            return None if dx or dy or relit_in_view else []
+        
+        # Repaint the blocks that changed in view
+        repainted = []
+        for block_x, block_y in dirty:
+            screen_x, screen_y = block_x - camera.x, block_y - camera.y
+            if 0 <= screen_x < width and 0 <= screen_y < height:
+                self.frame[screen_y, screen_x] = blocks[block_x, block_y]
+                repainted.append((screen_x, screen_y))
+        return None if dx or dy else repainted
+    
+    def draw_overview(self, level, center_x, center_y):
+        """Draw a level of the mip map centred on a world position instead of the blocks"""
+        size = 2**level
+        x_start = center_x // size - self.camera.width // 2
+        y_start = center_y // size - self.camera.height // 2
+        if not INFINITE_WORLD:
+            x_start = max(0, min(x_start, -(-WIDTH // size) - self.camera.width))
+        y_start = max(0, min(y_start, (MIP_HEIGHT >> level) - self.camera.height))
+        mip_map.update()
+        self.frame[:, :] = mip_map.region(level, x_start, x_start + self.camera.width,
+                                          y_start, y_start + self.camera.height).T
+        self.origin = None  # The blocks need repainting when the overview closes
+        if not self.direct:
+            pyxel.images[self.image_bank].set(0, 0, ["".join(row) for row in HEX_DIGITS[self.frame]])
+        pyxel.blt(0, 0, self.image_bank, 0, 0, self.camera.width, self.camera.height)
+        return x_start, y_start
+    
+    def draw(self):
+        repainted = self.refresh()
+        if not self.direct:
+            image = pyxel.images[self.image_bank]
+            if repainted is None:
+                image.set(0, 0, ["".join(row) for row in HEX_DIGITS[self.frame]])
+            else:
+                for screen_x, screen_y in repainted:
+                    image.pset(screen_x, screen_y, int(self.frame[screen_y, screen_x]))
+        pyxel.blt(0, 0, self.image_bank, 0, 0, self.camera.width, self.camera.height)
+
+class Inventory:
+    """The hotbar, HOTBAR_SLOTS stacks of up to STACK_SIZE blocks with one of them selected.
+    
+    Stacks are two fixed-size arrays of block types and counts, so any block type can
+    be carried in as many stacks as there is room for, and the whole hotbar saves as
+    a short list of [block type, count] pairs. An empty stack has a count of 0.
+    """
+    __slots__ = ("blocks", "counts", "selected")
+    
+    def __init__(self, stacks=()):
+        self.blocks = np.zeros(HOTBAR_SLOTS, dtype=np.uint8)
+        self.counts = np.zeros(HOTBAR_SLOTS, dtype=np.int16)
+        self.selected = 0
+        for block_type, count in stacks:
+            self.add(block_type, count)
+    
+    def stacks(self):
+        """(block type, count) of every slot"""
+        return list(zip(self.blocks.tolist(), self.counts.tolist()))
+    
+    def count(self, block_type):
+        """Total number of blocks of a type across the stacks"""
+        return int(self.counts[self.blocks == block_type].sum())
+    
+    def selected_block(self):
+        """Block type of the selected stack, or None if it's empty"""
+        return int(self.blocks[self.selected]) if self.counts[self.selected] > 0 else None
+    
+    def select(self, slot):
+        """Select a slot if it has blocks in it"""
+        if self.counts[slot] > 0:
+            self.selected = slot
+    
+    def add(self, block_type, count=1):
+        """Add blocks to the stacks of their type, then to empty slots, returning how many didn't fit.
+        
+        With nothing selected, the first stack they go into is selected.
+        """
+        slots = (np.flatnonzero((self.blocks == block_type) & (self.counts > 0)).tolist() +
+                 np.flatnonzero(self.counts == 0).tolist())
+        if slots and not self.counts[self.selected]:
+            self.selected = slots[0]
+        for slot in slots:
+            if not count:
+                break
+            added = min(count, STACK_SIZE - int(self.counts[slot]))
+            self.blocks[slot] = block_type
+            self.counts[slot] += added
+            count -= added
+        return count
+    
+    def space(self, block_type):
+        """How many more blocks of a type fit in the stacks"""
+        return int((STACK_SIZE - self.counts[(self.blocks == block_type) | (self.counts == 0)]).sum())
+    
+    def remove(self, block_type, count=1):
+        """Remove blocks of a type, from the selected stack first and then the last stacks along"""
+        slots = np.flatnonzero((self.blocks == block_type) & (self.counts > 0)).tolist()[::-1]
+        if self.selected in slots:
+            slots.remove(self.selected)
+            slots.insert(0, self.selected)
+        for slot in slots:
+            removed = min(count, int(self.counts[slot]))
+            self.counts[slot] -= removed
+            count -= removed
+        if slots and not self.counts[self.selected]:
+            self.select_next()
+    
+    def select_next(self):
+        # Select the next stack along that has any blocks
+        filled = np.flatnonzero(np.roll(self.counts, -self.selected) > 0)
+        if len(filled):
+            self.selected = (self.selected + int(filled[0])) % HOTBAR_SLOTS
+    
+    def take(self):
+        """Take a block from the selected stack, returning its type or None if the stack is empty.
+        
+        Taking the last block selects the next stack along that has any.
+        """
+        block_type = self.selected_block()
+        if block_type is None:
+            return None
+        self.counts[self.selected] -= 1
+        if not self.counts[self.selected]:
+            self.select_next()
+        return block_type
+    
+    def state(self):
+        """The hotbar as plain lists for a save file"""
+        return {"stacks": [list(stack) for stack in self.stacks()], "selected": self.selected}
+    
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild a hotbar from what state returned"""
+        inventory = cls()
+        for slot, (block_type, count) in enumerate(state["stacks"][:HOTBAR_SLOTS]):
+            inventory.blocks[slot] = block_type
+            inventory.counts[slot] = min(count, STACK_SIZE)
+        inventory.selected = state["selected"] % HOTBAR_SLOTS
+        return inventory
+
+class MiningState:
+    """The block being mined, how far along it is and the last block mined"""
+    __slots__ = ("active", "x", "y", "type", "progress", "total_time", "flash_state",
+                 "last_mined_x", "last_mined_y")
+    
     def __init__(self):
+        self.active = False
+        self.x = 0
+        self.y = 0
+        self.type = 0
+        self.progress = 0
+        self.total_time = 0
+        self.flash_state = False
+        self.last_mined_x = -1  # Track last mined block to prevent repeatedly mining same block
+        self.last_mined_y = -1
+    
+    def start(self, x, y, block_type):
+        """Start mining a block"""
+        self.active = True
+        self.x = x
+        self.y = y
+        self.type = block_type
+        self.progress = 0
+        self.total_time = int(MINING_TIME[block_type])
+        self.flash_state = False
+    
+    def finish(self):
+        """Stop mining a block that has been mined, remembering where it was"""
+        self.last_mined_x = self.x
+        self.last_mined_y = self.y
+        self.active = False
+
+class Game:
+    def __init__(self, headless=False):
+        # A headless game has no window and is ticked by calling update, as in benchmark
+        self.headless = headless
+        
         # Initialize Pyxel with the zoomed display size plus inventory bar
-        pyxel.init(DISPLAY_WIDTH, TOTAL_DISPLAY_HEIGHT, title="2D Minecraft Demake", fps=30, display_scale=8)
+        if not headless:
+            pyxel.init(DISPLAY_WIDTH, TOTAL_DISPLAY_HEIGHT, title="2D Minecraft Demake", fps=30, display_scale=8)
         
-        generate_terrain()
+        # Continue the saved world if there is one (headless games always start fresh)
+        saved = None
+        if not headless and os.path.exists(SAVE_FILE):
+            try:
+                saved = load_world(SAVE_FILE)
+            except (ValueError, KeyError, struct.error):  # An old or foreign save file starts a new world
+                saved = None
+        if saved is None:
+            create_world()
         
         # Create player at a good starting position
         spawn_x = WIDTH // 2
         spawn_y = 0
         # Find suitable y position just above the terrain
-        for y in range(HEIGHT):
-            if y + PLAYER_HEIGHT < HEIGHT and blocks[spawn_x, y + PLAYER_HEIGHT] != AIR:
-                spawn_y = y - 2  # Position player slightly above the ground
-                break
+        ground_y = surface_top(spawn_x)
+        if PLAYER_HEIGHT <= ground_y < HEIGHT:
+            spawn_y = ground_y - PLAYER_HEIGHT - 2  # Position player slightly above the ground
         # Ensure player is not spawning too deep
         if spawn_y > HEIGHT // 2:
             spawn_y = HEIGHT // 4
         
         self.player = Player(spawn_x, spawn_y)
         self.camera = Camera(self.player)
+        self.mobs = Mobs()
+        self.renderer = None if headless else ViewportRenderer(self.camera)
         
-        # Initialize inventory
-        # Dictionary of block types the player has with counts
-        self.inventory = {
-            DIRT: 5,     # Start with 5 dirt blocks
-            GRASS: 3,    # Start with 3 grass blocks
-            STONE: 0,
-            SAND: 0,
-            WATER: 0,
-            COAL_ORE: 0,
-            IRON_ORE: 0,
-            GOLD_ORE: 0,
-            DIAMOND_ORE: 0
-        }
-        
-        # Selected block for placement
-        self.selected_block = DIRT  # Start with dirt selected
+        # Initialize the hotbar with a few blocks, the first slot selected for placement
+        self.inventory = Inventory(STARTING_BLOCKS)
+        
+        # Nothing is being mined yet
+        self.mining = MiningState()
+        
+        if saved is not None:
+            self.player.x, self.player.y = saved["player"]
+            self.inventory = Inventory.from_state(saved["inventory"])
+        
+        # Overview zoom level, 0 shows the blocks
+        self.overview = 0
         
         # Mining settings
         self.flash_counter = 0
         self.flash_rate = 3  # Frames per flash
         
-        pyxel.run(self.update, self.draw)
+        if not headless:
+            pyxel.run(self.update, self.draw)
     
     def update(self):
-        # Check for quit
-        if pyxel.btnp(pyxel.KEY_Q):
+        # Check for quit, saving the world first
+        if controls.btnp(pyxel.KEY_Q) and not self.headless:
+            save_world(SAVE_FILE, self.player, self.inventory)
             pyxel.quit()
         
+        # Every so often append the blocks that have changed to the save file
+        journal.tick += 1
+        if journal.tick % AUTOSAVE_INTERVAL == 0 and not self.headless:
+            autosave(SAVE_FILE, self.player, self.inventory)
+        
+        # Undo or redo the blocks mined and placed
+        if controls.btnp(UNDO_KEY):
+            journal.undo(self.inventory)
+        elif controls.btnp(REDO_KEY):
+            journal.redo(self.inventory)
+        
         # Update player
         self.player.update()
         
         # Update camera to follow player
         self.camera.update()
         
+        # Generate the chunks the camera is about to reach
+        if INFINITE_WORLD:
+            blocks.preload(self.camera.x - CHUNK_PRELOAD_MARGIN,
+                           self.camera.x + self.camera.width + CHUNK_PRELOAD_MARGIN)
+        
+        # Move the mobs
+        self.mobs.update(self.player)
+        
         # Handle block selection
         self.handle_block_selection()
         
-        # Handle mining
-        self.handle_mining()
+        # Cycle through the overview zoom levels
+        if controls.btnp(OVERVIEW_KEY):
+            self.overview = (self.overview + 1) % (MIP_LEVELS + 1)
         
-        # Handle block placing
-        self.handle_placing()
+        # Handle mining and block placing (the mouse doesn't point at blocks in the overview)
+        if not self.overview:
+            self.handle_mining()
+            self.handle_placing()
         
         # Update mining progress
         self.update_mining_progress()
+        
+        # Let water flow and unsupported blocks fall
+        simulate_water()
+        simulate_falling_blocks()
     
     def handle_block_selection(self):
-        # Check number keys for block selection
-        for key, block_type in BLOCK_KEYS.items():
-            if pyxel.btnp(key):
-                # Only select if player has this block
-                if self.inventory.get(block_type, 0) > 0:
-                    self.selected_block = block_type
-    
-    def find_next_available_block(self):
-        """Find the next available block in inventory after current selection is depleted"""
-        # Get all block types in order of their keys
-        block_types = [block_type for _, block_type in sorted(BLOCK_KEYS.items())]
-        
-        # Find current block index
-        try:
-            current_index = block_types.index(self.selected_block)
-        except ValueError:
-            current_index = -1
-        
-        # Search for next available block, starting after current
-        for i in range(1, len(block_types) + 1):
-            next_index = (current_index + i) % len(block_types)
-            block_type = block_types[next_index]
-            if self.inventory.get(block_type, 0) > 0:
-                self.selected_block = block_type
-                return
-        
-        # If no blocks available, default to first type (even with 0 count)
-        self.selected_block = block_types[0]
+        # Check number keys for slot selection (empty slots can't be selected)
+        for slot, key in enumerate(SLOT_KEYS):
+            if controls.btnp(key):
+                self.inventory.select(slot)
     
     def handle_mining(self):
         # Start mining a block on mouse click or continue mining if mouse is held down
-        if pyxel.btn(pyxel.MOUSE_BUTTON_LEFT):
+        if controls.btn(pyxel.MOUSE_BUTTON_LEFT):
             # If we're not currently mining a block, or if we've finished mining a block,
             # try to start mining a new block
-            if not mining_block["active"]:
+            if not self.mining.active:
                 # Convert screen coordinates to world coordinates
-                world_x, world_y = self.camera.screen_to_world(pyxel.mouse_x, pyxel.mouse_y)
+                world_x, world_y = self.camera.screen_to_world(controls.mouse_x, controls.mouse_y)
                 
                 # Skip if this is the block we just mined to prevent immediately re-mining it
-                if (world_x == mining_block["last_mined_x"] and 
-                    world_y == mining_block["last_mined_y"]):
+                if world_x == self.mining.last_mined_x and world_y == self.mining.last_mined_y:
                     return
                 
                 # Check if clicked position is within world bounds
-                if (0 <= world_x < WIDTH and 0 <= world_y < HEIGHT):
+                if in_world(world_x, world_y):
+                    # Hit any mob on the clicked block instead of mining behind it
+                    if self.player.can_reach_block(world_x, world_y) and self.mobs.hit(world_x, world_y):
+                        return
+                    
                     # Check if there's a block to mine
                     block_type = blocks[world_x, world_y]
                     
@@ -663,22 +2261,16 @@ class Game:
                                         # Check if player can reach this block
                         if self.player.can_reach_block(world_x, world_y):
                             # Start mining this block
-                            mining_block["active"] = True
-                            mining_block["x"] = world_x
-                            mining_block["y"] = world_y
-                            mining_block["type"] = block_type
-                            mining_block["progress"] = 0
-                            mining_block["total_time"] = MINING_TIMES.get(block_type, 30)
-                            mining_block["flash_state"] = False
+                            self.mining.start(world_x, world_y, int(block_type))
     
     def handle_placing(self):
         # Place a block with right mouse button
-        if pyxel.btnp(pyxel.MOUSE_BUTTON_RIGHT):
+        if controls.btnp(pyxel.MOUSE_BUTTON_RIGHT):
             # Convert screen coordinates to world coordinates
-            world_x, world_y = self.camera.screen_to_world(pyxel.mouse_x, pyxel.mouse_y)
+            world_x, world_y = self.camera.screen_to_world(controls.mouse_x, controls.mouse_y)
             
             # Check if clicked position is within world bounds
-            if (0 <= world_x < WIDTH and 0 <= world_y < HEIGHT):
+            if in_world(world_x, world_y):
                 # Check if there's no block at this position (can only place on AIR)
                 if blocks[world_x, world_y] == AIR:
                     # Check if player can reach this position
@@ -689,91 +2281,73 @@ class Game:
                         
                         # Don't place block on player
                         if not (world_x == player_x and (world_y == player_y or world_y == player_body_y)):
-                            # Check if player has this block in inventory
-                            if self.inventory.get(self.selected_block, 0) > 0:
-                                # Place the selected block
-                                blocks[world_x, world_y] = self.selected_block
-                                
-                                # Decrease block count in inventory
-                                self.inventory[self.selected_block] -= 1
-                                
-                                # If we're out of this block type, select a different block if available
-                                if self.inventory[self.selected_block] <= 0:
-                                    self.find_next_available_block()
+                            # Place a block from the selected stack if it isn't empty
+                            # (the next stack is selected when it runs out)
+                            block_type = self.inventory.take()
+                            if block_type is not None:
+                                set_block(world_x, world_y, block_type, player=True, held=-1)
     
     def update_mining_progress(self):
         # Update mining progress if we're mining a block
-        if mining_block["active"]:
+        mining = self.mining
+        if mining.active:
             # Increment progress
-            mining_block["progress"] += 1
+            mining.progress += 1
             
             # Update flash state
             self.flash_counter += 1
             if self.flash_counter >= self.flash_rate:
                 self.flash_counter = 0
-                mining_block["flash_state"] = not mining_block["flash_state"]
+                mining.flash_state = not mining.flash_state
             
             # Check if mining is complete
-            if mining_block["progress"] >= mining_block["total_time"]:
-                # Mining complete, add to inventory
-                block_type = mining_block["type"]
-                self.inventory[block_type] = self.inventory.get(block_type, 0) + 1
+            if mining.progress >= mining.total_time:
+                # Mining complete, add to inventory (the block is lost if the hotbar is full)
+                held = 1 - self.inventory.add(mining.type)
                 
                 # Remove block from world
-                blocks[mining_block["x"], mining_block["y"]] = AIR
-                
-                # Store the position of the last mined block
-                mining_block["last_mined_x"] = mining_block["x"]
-                mining_block["last_mined_y"] = mining_block["y"]
+                set_block(mining.x, mining.y, AIR, player=True, held=held)
                 
-                # Reset mining state
-                mining_block["active"] = False
+                # Store the position of the last mined block and reset mining state
+                mining.finish()
             
             # Check if player is still in range
-            elif not self.player.can_reach_block(mining_block["x"], mining_block["y"]):
+            elif not self.player.can_reach_block(mining.x, mining.y):
                 # Player moved out of range, cancel mining
-                mining_block["active"] = False
+                mining.active = False
             
             # Check if user is still holding mouse button
-            elif not pyxel.btn(pyxel.MOUSE_BUTTON_LEFT):
+            elif not controls.btn(pyxel.MOUSE_BUTTON_LEFT):
                 # Player released mouse button, cancel mining
-                mining_block["active"] = False
+                mining.active = False
     
     def draw(self):
         pyxel.cls(0)
         
-        # Only draw blocks that are within the camera view
-        for x in range(self.camera.width):
-            for y in range(self.camera.height):
-                # Convert screen coordinates to world coordinates
-                world_x = x + self.camera.x
-                world_y = y + self.camera.y
-                
-                # Make sure we're within the world bounds
-                if 0 <= world_x < WIDTH and 0 <= world_y < HEIGHT:
-                    block_type = blocks[world_x, world_y]
-                    
-                    # Check if this is the block being mined
-                    is_mining_block = (mining_block["active"] and 
-                                      world_x == mining_block["x"] and 
-                                      world_y == mining_block["y"])
-                    
-                    # Draw the block
-                    if block_type != AIR:  # Don't draw air blocks
-                        # If it's the block being mined and in a flash state, draw as black
-                        if is_mining_block and mining_block["flash_state"]:
-                            pyxel.pset(x, y, BEDROCK)  # Flash to black
-                        else:
-                            pyxel.pset(x, y, block_type)
+        # Draw the overview around the player instead of the blocks if it's open
+        if self.overview:
+            x_start, y_start = self.renderer.draw_overview(self.overview, int(self.player.x), int(self.player.y))
+            pyxel.pset(int(self.player.x) // 2**self.overview - x_start,
+                       int(self.player.y) // 2**self.overview - y_start, PLAYER_COLOR)
+            self.draw_inventory()
+            return
+        
+        # Draw the blocks within the camera view
+        self.renderer.draw()
+        
+        # If the block being mined is in a flash state, draw it as black
+        if self.mining.active and self.mining.flash_state:
+            pyxel.pset(self.mining.x - self.camera.x, self.mining.y - self.camera.y, BEDROCK)
         
-        # Draw player relative to camera
+        # Draw the mobs and the player relative to camera
+        self.mobs.draw(self.camera)
         self.player.draw(self.camera)
         
         # Draw inventory bar
         self.draw_inventory()
         
         # Draw mining progress bar if mining
-        if mining_block["active"]:
+        if self.mining.active:
             self.draw_mining_progress()
         
         # Draw mining/placing indicator on mouse hover
@@ -781,32 +2355,17 @@ class Game:
     
     def draw_inventory(self):
         # Draw background for inventory bar
-        for y in range(DISPLAY_HEIGHT, TOTAL_DISPLAY_HEIGHT):
-            for x in range(DISPLAY_WIDTH):
-                pyxel.pset(x, y, 0)  # Black background
-        
-        # Define inventory slots - each material gets a 1-pixel space
-        inventory_items = [
-            (DIRT, 1),
-            (GRASS, 2),
-            (STONE, 3),
-            (SAND, 4),
-            (WATER, 5),
-            (COAL_ORE, 6),
-            (IRON_ORE, 7),
-            (GOLD_ORE, 8),
-            (DIAMOND_ORE, 9),
-        ]
+        pyxel.rect(0, DISPLAY_HEIGHT, DISPLAY_WIDTH, INVENTORY_HEIGHT, 0)  # Black background
         
-        # Draw inventory items
-        for block_type, x_pos in inventory_items:
-            block_count = self.inventory.get(block_type, 0)
+        # Draw the hotbar slots - each stack gets a 1-pixel space
+        for slot, (block_type, block_count) in enumerate(self.inventory.stacks()):
+            x_pos = slot + 1
             if block_count > 0:
                 # Draw filled slot if player has this material
                 pyxel.pset(x_pos, DISPLAY_HEIGHT + 1, block_type)
                 
-                # Draw white pixel under selected block
-                if block_type == self.selected_block:
+                # Draw white pixel under selected slot
+                if slot == self.inventory.selected:
                     pyxel.pset(x_pos, DISPLAY_HEIGHT + 2, 7)  # White (color 7)
     
     def draw_mining_progress(self):
@@ -815,21 +2374,21 @@ class Game:
     
     def draw_interaction_indicator(self):
         # Get world coordinates of mouse position
-        mouse_world_x, mouse_world_y = self.camera.screen_to_world(pyxel.mouse_x, pyxel.mouse_y)
+        mouse_world_x, mouse_world_y = self.camera.screen_to_world(controls.mouse_x, controls.mouse_y)
         
         # Check if mouse is within display bounds
-        if 0 <= pyxel.mouse_x < DISPLAY_WIDTH and 0 <= pyxel.mouse_y < DISPLAY_HEIGHT:
+        if 0 <= controls.mouse_x < DISPLAY_WIDTH and 0 <= controls.mouse_y < DISPLAY_HEIGHT:
             # Check if position is valid and within world bounds
-            if 0 <= mouse_world_x < WIDTH and 0 <= mouse_world_y < HEIGHT:
+            if in_world(mouse_world_x, mouse_world_y):
                 block_type = blocks[mouse_world_x, mouse_world_y]
                 can_reach = self.player.can_reach_block(mouse_world_x, mouse_world_y)
                 
                 if block_type != AIR:
                     # Show mining indicator (green for in range, pink for out of range)
                     if can_reach:
-                        pyxel.pset(pyxel.mouse_x, pyxel.mouse_y, 11)  # Green for mining
+                        pyxel.pset(controls.mouse_x, controls.mouse_y, 11)  # Green for mining
                     else:
-                        pyxel.pset(pyxel.mouse_x, pyxel.mouse_y, 8)   # Pink for out of range
+                        pyxel.pset(controls.mouse_x, controls.mouse_y, 8)   # Pink for out of range
                 else:
                     # Show placing indicator (white for in range, pink for out of range)
                     if can_reach:
@@ -838,20 +2397,77 @@ class Game:
                         player_body_y = int(self.player.y + 1)
                         
                         # Check if player has selected block in inventory
-                        has_block = self.inventory.get(self.selected_block, 0) > 0
+                        has_block = self.inventory.selected_block() is not None
                         
                         if (mouse_world_x == player_x and 
                             (mouse_world_y == player_y or mouse_world_y == player_body_y)):
                             # Can't place here (would trap player)
-                            pyxel.pset(pyxel.mouse_x, pyxel.mouse_y, 8)  # Pink 
+                            pyxel.pset(controls.mouse_x, controls.mouse_y, 8)  # Pink 
                         elif not has_block:
                             # Don't have this block in inventory
-                            pyxel.pset(pyxel.mouse_x, pyxel.mouse_y, 8)  # Pink
+                            pyxel.pset(controls.mouse_x, controls.mouse_y, 8)  # Pink
                         else:
                             # Can place block here
-                            pyxel.pset(pyxel.mouse_x, pyxel.mouse_y, 7)  # White for placing
+                            pyxel.pset(controls.mouse_x, controls.mouse_y, 7)  # White for placing
                     else:
-                        pyxel.pset(pyxel.mouse_x, pyxel.mouse_y, 8)   # Pink for out of range
+                        pyxel.pset(controls.mouse_x, controls.mouse_y, 8)   # Pink for out of range
+
+# Scripted input for the benchmark: (ticks, keys held, mouse x, mouse y), with the
+# player drawn at screen (7, 7) and (7, 8)
+BENCHMARK_SCRIPT = [
+    (30, [pyxel.KEY_RIGHT], 7, 7),  # Walk right
+    (40, [pyxel.MOUSE_BUTTON_LEFT], 8, 9),  # Mine the block ahead of the player's feet
+    (60, [pyxel.MOUSE_BUTTON_LEFT], 7, 9),  # Mine down through the ground
+    (1, [pyxel.MOUSE_BUTTON_RIGHT], 6, 8),  # Place a block behind the player
+    (20, [pyxel.KEY_LEFT, pyxel.KEY_SPACE], 7, 7),  # Jump back left
+    (1, [], 7, 7),
+]
+
+def peak_memory_mb():
+    """Peak memory used by this process in megabytes, or None where it can't be measured"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return peak / 1024 ** 2 if os.uname().sysname == "Darwin" else peak / 1024
+
+def benchmark(ticks=1000, width=WIDTH, infinite=False, script=BENCHMARK_SCRIPT):
+    """Play the game headless on scripted input and time it.
+    
+    Returns the seconds taken to generate the world, the ticks per second of
+    Game.update and the peak memory of the process, to compare world sizes and
+    optimizations. Drawing isn't included.
+    """
+    global WIDTH, INFINITE_WORLD, controls
+    WIDTH, INFINITE_WORLD = width, infinite
+    controls = ScriptedInput(script)
+    
+    start = time.perf_counter()
+    game = Game(headless=True)
+    generation_time = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    for _ in range(ticks):
+        controls.advance()
+        game.update()
+        dirty_blocks.clear()  # Nothing draws the changed blocks, so don't let them pile up
+    tick_time = time.perf_counter() - start
+    
+    return {
+        "generation_seconds": generation_time,
+        "ticks_per_second": ticks / tick_time,
+        "peak_memory_mb": peak_memory_mb(),
+    }
 
 if __name__ == "__main__":
-    Game()
\ No newline at end of file
+    parser = argparse.ArgumentParser(prog="game.py", description="2D Minecraft Demake")
+    parser.add_argument("--benchmark", action="store_true", help="play scripted input without a window and report timings")
+    parser.add_argument("--ticks", type=int, default=1000, help="ticks to run the benchmark for")
+    parser.add_argument("--width", type=int, default=WIDTH, help="width of the benchmark world")
+    parser.add_argument("--infinite", action="store_true", help="benchmark an infinite world")
+    args, _ = parser.parse_known_args()  # Leave pyxel's own arguments (pyxel run game.py)
+    if args.benchmark:
+        for name, value in benchmark(args.ticks, args.width, args.infinite).items():
+            print(f"{name}: {value}")
+    else:
+        Game()
\ No newline at end of file